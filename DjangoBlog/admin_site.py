@@ -45,15 +45,29 @@ class DjangoBlogAdminSite(AdminSite):
     def has_permission(self, request):
         return request.user.is_superuser
 
-    # def get_urls(self):
-    #     urls = super().get_urls()
-    #     from django.urls import path
-    #     from blog.views import refresh_memcache
-    #
-    #     my_urls = [
-    #         path('refresh/', self.admin_view(refresh_memcache), name="refresh"),
-    #     ]
-    #     return urls + my_urls
+    def get_urls(self):
+        urls = super().get_urls()
+        from django.urls import path
+
+        my_urls = [
+            path('cache_stats/', self.admin_view(self.cache_stats_view), name="cache_stats"),
+        ]
+        return my_urls + urls
+
+    def cache_stats_view(self, request):
+        '''
+        按key命名空间显示缓存统计
+        '''
+        from django.template.response import TemplateResponse
+        from DjangoBlog.cache_stats import get_stats, reset_stats
+        if request.method == 'POST':
+            reset_stats()
+        context = dict(
+            self.each_context(request),
+            title='緩存統計',
+            stats=get_stats(),
+        )
+        return TemplateResponse(request, 'admin/cache_stats.html', context)
 
 
 admin_site = DjangoBlogAdminSite(name='admin')
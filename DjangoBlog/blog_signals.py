@@ -20,14 +20,17 @@ from django.dispatch import receiver
 from django.conf import settings
 from django.contrib.admin.models import LogEntry
 from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
+from django.contrib.sessions.models import Session
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 
-from oauth.models import OAuthUser
+from blog.models import Article, refresh_article_counts
+from blog.archives import ARCHIVE_FIELDS, update_archive_index
 from comments.models import Comment
 from comments.utils import send_comment_email
-from DjangoBlog.utils import get_current_site
-from DjangoBlog.utils import cache, expire_view_cache, delete_sidebar_cache, delete_view_cache
+from DjangoBlog.utils import get_current_site, clear_current_site
+from DjangoBlog.utils import expire_view_cache, invalidate_cache_tags
 from DjangoBlog.spider_notify import SpiderNotify
 
 logger = logging.getLogger(__name__)
@@ -67,13 +70,8 @@ def send_email_signal_handler(sender, **kwargs):
 
 @receiver(oauth_user_login_signal)
 def oauth_user_login_signal_handler(sender, **kwargs):
-    id = kwargs['id']
-    oauthuser = OAuthUser.objects.get(id=id)
-    site = get_current_site().domain
-
-    delete_sidebar_cache(oauthuser.author.username)
-
-    cache.clear()
+    # 侧边栏与用户无关,登录状态是用户片段,不需要清除缓存,也不需要查询用户
+    logger.info('oauth user login.id:{id}'.format(id=kwargs['id']))
 
 
 @receiver(post_save)
@@ -86,17 +84,20 @@ def model_post_save_callback(
         update_fields,
         **kwargs):
     clearcache = False
-    if isinstance(instance, LogEntry):
+    if isinstance(instance, (LogEntry, Session)):
+        return
+    is_update_views = update_fields == {'views'}
+    # 每次登录都会保存last_login,页面不显示这个字段,不使缓存失效
+    if update_fields == {'last_login'}:
         return
     if 'get_full_url' in dir(instance):
-        is_update_views = update_fields == {'views'}
         if not settings.TESTING and not is_update_views:
             try:
                 notify_url = instance.get_full_url()
             except Exception as ex:
                 logger.error("notify sipder", ex)
-        if not is_update_views:
-            clearcache = True
+    if not is_update_views:
+        clearcache = True
     if isinstance(instance, Comment):
 
         path = instance.article.get_absolute_url()
@@ -109,18 +110,33 @@ def model_post_save_callback(
             servername=site,
             serverport=80,
             key_prefix='blogdetail')
-        if cache.get('seo_processor'):
-            cache.delete('seo_processor')
-        comment_cache_key = 'article_comments_{id}'.format(
-            id=instance.article.id)
-        cache.delete(comment_cache_key)
-        delete_sidebar_cache(instance.author.username)
-        delete_view_cache('article_comments', [str(instance.article.pk)])
 
         _thread.start_new(send_comment_email, (instance,))
 
     if clearcache:
-        cache.clear()
+        invalidate_cache_tags(instance)
+
+
+@receiver(post_delete)
+def model_post_delete_callback(sender, instance, using, **kwargs):
+    if isinstance(instance, (LogEntry, Session)):
+        return
+    invalidate_cache_tags(instance)
+
+
+@receiver(m2m_changed)
+def model_m2m_changed_callback(
+        sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    invalidate_cache_tags(instance, model)
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def site_changed_callback(sender, **kwargs):
+    # 本进程立即失效,其他worker通过sites.site的缓存版本发现,见DjangoBlog.utils.get_current_site
+    clear_current_site()
 
 
 @receiver(user_logged_in)
@@ -128,5 +144,65 @@ def model_post_save_callback(
 def user_auth_callback(sender, request, user, **kwargs):
     if user and user.username:
         logger.info(user)
-        delete_sidebar_cache(user.username)
-        cache.clear()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def author_post_save_callback(sender, instance, created, update_fields, **kwargs):
+    # 文章卡片和文章页显示作者的用户名和链接,只使这个作者的文章失效
+    if created or (update_fields and 'username' not in update_fields):
+        return
+    invalidate_cache_tags(*['blog.article:{id}'.format(id=id) for id in
+                            Article.objects.filter(author=instance).values_list('id', flat=True)])
+
+
+@receiver(post_save, sender=Article)
+def article_post_save_callback(sender, instance, created, update_fields, **kwargs):
+    # 更新标签和分类的文章数,包括修改前的分类
+    if update_fields and not {'status', 'category'} & set(update_fields):
+        return
+    tag_ids = () if created else instance.tags.values_list('id', flat=True)
+    refresh_article_counts(tag_ids, (instance.category_id, getattr(
+        instance, '_loaded_category_id', None)))
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Article)
+def article_archive_post_save_callback(sender, instance, update_fields, **kwargs):
+    # 更新归档索引中的这篇文章
+    if update_fields and not set(ARCHIVE_FIELDS) & set(update_fields):
+        return
+    update_archive_index([instance])
+
+
+@receiver(post_delete, sender=Article)
+def article_archive_post_delete_callback(sender, instance, **kwargs):
+    update_archive_index([instance], deleted=True)
+
+
+@receiver(pre_delete, sender=Article)
+def article_pre_delete_callback(sender, instance, **kwargs):
+    # 删除之后文章的标签已经不存在,先记录
+    instance._count_tag_ids = list(instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Article)
+def article_post_delete_callback(sender, instance, **kwargs):
+    refresh_article_counts(
+        getattr(instance, '_count_tag_ids', ()), (instance.category_id,))
+
+
+@receiver(m2m_changed, sender=Article.tags.through)
+def article_tags_changed_callback(
+        sender, instance, action, reverse, model, pk_set, **kwargs):
+    if reverse:
+        # 从标签一侧修改,只影响这个标签
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_article_counts((instance.pk,))
+        return
+    if action == 'pre_clear':
+        instance._count_tag_ids = list(
+            instance.tags.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        refresh_article_counts(pk_set)
+    elif action == 'post_clear':
+        refresh_article_counts(getattr(instance, '_count_tag_ids', ()))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: cache_stats.py
+@time: 2026/10/18
+
+按key命名空间统计缓存的命中,未命中,写入,淘汰,值大小和重新计算耗时.
+每个进程先在内存中累加,每隔FLUSH_INTERVAL秒用incr合并到多个worker共享的缓存中,
+通过./manage.py cache_stats或后台的缓存统计页面查看.
+"""
+import logging
+import re
+import threading
+import time
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# 统计项: 命中,未命中,写入,删除,淘汰,抽样写入的字节数,抽样的写入次数,重新计算次数,重新计算耗时(毫秒)
+METRICS = ('hits', 'misses', 'sets', 'deletes', 'evictions',
+           'set_bytes', 'sized_sets', 'computes', 'compute_ms')
+
+STATS_KEY_PREFIX = 'cache_stats:'
+NAMESPACES_KEY = STATS_KEY_PREFIX + 'namespaces'
+
+STATS_CACHE = 'shared'
+FLUSH_INTERVAL = 10
+
+_stats = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_last_flush = time.time()
+
+_template_fragment_re = re.compile(r'^(template\.cache\.[^.]+)\.')
+
+
+def key_namespace(key):
+    """
+    获得key的命名空间
+    模板片段: template.cache.片段名, 模型方法: app.model:方法名, 函数: 模块:函数名, 其余为第一个':'或'/'之前的部分
+    :param key: 缓存key
+    :return:
+    """
+    key = str(key)
+    match = _template_fragment_re.match(key)
+    if match:
+        return match.group(1)
+    parts = re.split(r'[:/]', key, 3)
+    if len(parts) > 2 and '.' in parts[0]:
+        if parts[1].isdigit():
+            return '{model}:{method}'.format(model=parts[0], method=parts[2])
+        return '{module}:{name}'.format(module=parts[0], name=parts[1])
+    return parts[0]
+
+
+def record(namespace, metric, value=1):
+    with _lock:
+        stats = _stats.get(namespace)
+        if stats is None:
+            stats = _stats[namespace] = dict.fromkeys(METRICS, 0)
+        stats[metric] += value
+    if time.time() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def _incr(store, key, value):
+    try:
+        store.incr(key, value)
+    except ValueError:
+        if not store.add(key, value, None):
+            store.incr(key, value)
+
+
+def flush():
+    """
+    把本进程的统计合并到共享缓存
+    """
+    global _stats, _last_flush
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        with _lock:
+            stats, _stats = _stats, {}
+            _last_flush = time.time()
+        if not stats:
+            return
+        store = caches[STATS_CACHE]
+        for namespace, values in stats.items():
+            for metric, value in values.items():
+                if value:
+                    _incr(store, '{prefix}{namespace}:{metric}'.format(
+                        prefix=STATS_KEY_PREFIX, namespace=namespace, metric=metric), int(value))
+        namespaces = store.get(NAMESPACES_KEY) or set()
+        if not namespaces.issuperset(stats):
+            store.set(NAMESPACES_KEY, namespaces | set(stats), None)
+    except Exception as e:
+        logger.error(e)
+    finally:
+        _flush_lock.release()
+
+
+def get_stats():
+    """
+    获得所有worker的统计
+    :return: [dict],按访问次数排序
+    """
+    flush()
+    store = caches[STATS_CACHE]
+    namespaces = store.get(NAMESPACES_KEY) or set()
+    keys = ['{prefix}{namespace}:{metric}'.format(prefix=STATS_KEY_PREFIX, namespace=namespace, metric=metric)
+            for namespace in namespaces for metric in METRICS]
+    values = store.get_many(keys)
+    result = []
+    for namespace in namespaces:
+        item = {'namespace': namespace}
+        for metric in METRICS:
+            item[metric] = values.get('{prefix}{namespace}:{metric}'.format(
+                prefix=STATS_KEY_PREFIX, namespace=namespace, metric=metric), 0)
+        lookups = item['hits'] + item['misses']
+        item['hit_ratio'] = item['hits'] / lookups if lookups else 0
+        item['avg_bytes'] = item['set_bytes'] // item['sized_sets'] if item['sized_sets'] else 0
+        item['avg_compute_ms'] = item['compute_ms'] / \
+            item['computes'] if item['computes'] else 0
+        result.append(item)
+    return sorted(result, key=lambda item: item['hits'] + item['misses'], reverse=True)
+
+
+def reset_stats():
+    global _stats
+    with _lock:
+        _stats = {}
+    store = caches[STATS_CACHE]
+    namespaces = store.get(NAMESPACES_KEY) or set()
+    store.delete_many(['{prefix}{namespace}:{metric}'.format(prefix=STATS_KEY_PREFIX, namespace=namespace, metric=metric)
+                       for namespace in namespaces for metric in METRICS])
+    store.delete(NAMESPACES_KEY)
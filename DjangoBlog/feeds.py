@@ -17,7 +17,9 @@ from django.contrib.syndication.views import Feed
 from blog.models import Article
 from django.conf import settings
 from django.utils.feedgenerator import Rss201rev2Feed
-from DjangoBlog.utils import CommonMarkdown
+from django.db.models import Max
+from django.views.decorators.http import condition
+from DjangoBlog.utils import get_page_etag, patch_cache_control_policy
 from django.contrib.auth import get_user_model
 from datetime import datetime
 
@@ -28,6 +30,20 @@ class DjangoBlogFeed(Feed):
     description = '大巧无工,重剑无锋.'
     title = "且听风吟 大巧无工,重剑无锋. "
     link = "/feed/"
+    etag_depends_on = ('blog.article', 'accounts.bloguser')
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return Article.objects.filter(type='a', status='p').aggregate(
+            Max('last_mod_time'))['last_mod_time__max']
+
+    def get_etag(self, request, *args, **kwargs):
+        return get_page_etag(self.etag_depends_on)
+
+    def __call__(self, request, *args, **kwargs):
+        view = condition(etag_func=self.get_etag, last_modified_func=self.get_last_modified)(
+            super(DjangoBlogFeed, self).__call__)
+        return patch_cache_control_policy(
+            request, view(request, *args, **kwargs), 'feed')
 
     def author_name(self):
         return get_user_model().objects.first().nickname
@@ -42,7 +58,7 @@ class DjangoBlogFeed(Feed):
         return item.title
 
     def item_description(self, item):
-        return CommonMarkdown.get_markdown(item.body)
+        return item.body_html
 
     def feed_copyright(self):
         now = datetime.now()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: instrumented_cache_backend.py
+@time: 2026/10/18
+
+记录统计信息的缓存包装,读写转发给CACHE配置的缓存,统计见DjangoBlog.cache_stats.
+未命中之后同一线程写入同一个key的间隔记为重新计算耗时.
+值的大小需要再序列化一次,每个命名空间只抽样第一次和之后每SIZE_SAMPLE_RATE次写入.
+
+配置:
+CACHES = {
+    'default': {
+        'BACKEND': 'DjangoBlog.instrumented_cache_backend.InstrumentedCache',
+        'OPTIONS': {
+            'CACHE': 'twotier',
+            'STATS_CACHE': 'shared',
+            'FLUSH_INTERVAL': 10,
+            'SIZE_SAMPLE_RATE': 10,
+        }
+    },
+    'twotier': {...},
+}
+"""
+import pickle
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+from DjangoBlog import cache_stats
+from DjangoBlog.cache_stats import key_namespace, record
+
+_MISSING = object()
+
+
+class InstrumentedCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._alias = options.get('CACHE', 'twotier')
+        cache_stats.STATS_CACHE = options.get('STATS_CACHE', 'shared')
+        cache_stats.FLUSH_INTERVAL = float(options.get('FLUSH_INTERVAL', 10))
+        self._size_sample_rate = max(int(options.get('SIZE_SAMPLE_RATE', 10)), 1)
+        # 每个命名空间的写入次数,用于抽样值的大小
+        self._set_counts = {}
+        # 未命中的key和时间,用于计算重新计算耗时
+        self._local = threading.local()
+
+    @property
+    def cache(self):
+        return caches[self._alias]
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None or len(pending) > 1000:
+            pending = self._local.pending = {}
+        return pending
+
+    def _record_get(self, key, hit):
+        namespace = key_namespace(key)
+        if hit:
+            record(namespace, 'hits')
+        else:
+            record(namespace, 'misses')
+            self._pending()[key] = time.time()
+
+    def _record_set(self, key, value):
+        namespace = key_namespace(key)
+        record(namespace, 'sets')
+        count = self._set_counts.get(namespace, 0)
+        self._set_counts[namespace] = count + 1
+        if count % self._size_sample_rate == 0:
+            try:
+                record(namespace, 'set_bytes', len(
+                    pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+                record(namespace, 'sized_sets')
+            except Exception:
+                pass
+        start = self._pending().pop(key, None)
+        if start is not None:
+            record(namespace, 'computes')
+            record(namespace, 'compute_ms', (time.time() - start) * 1000)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        result = self.cache.add(key, value, timeout, version=version)
+        if result:
+            self._record_set(key, value)
+        return result
+
+    def get(self, key, default=None, version=None):
+        value = self.cache.get(key, _MISSING, version=version)
+        self._record_get(key, value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.cache.set(key, value, timeout, version=version)
+        self._record_set(key, value)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.cache.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        record(key_namespace(key), 'deletes')
+        return self.cache.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.cache.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        return self.cache.incr(key, delta, version=version)
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self.cache.get_many(keys, version=version)
+        for key in keys:
+            self._record_get(key, key in found)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = self.cache.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed_keys:
+                self._record_set(key, value)
+        return failed_keys
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            record(key_namespace(key), 'deletes')
+        self.cache.delete_many(keys, version=version)
+
+    def clear(self):
+        self.cache.clear()
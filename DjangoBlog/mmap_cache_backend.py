@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: mmap_cache_backend.py
+@time: 2026/10/18
+
+基于内存映射文件的缓存,同一台机器上的所有gunicorn worker共享一份数据,worker重启后数据仍然保留.
+
+文件结构:
+    header | 每个bucket的slot表 | 每个bucket的数据区
+固定大小的哈希表,key按hash分配到bucket.每个bucket有若干个slot,
+每个slot对应数据区中一个固定大小的chunk(SLOTS),写入时选择能放下数据的最小chunk,
+没有空闲chunk时淘汰其中最久未访问的条目(LRU),有过期时间的条目优先淘汰,
+不过期的条目(如DjangoBlog.utils中缓存标签的版本)丢失会使依赖它的缓存全部失效.
+每个bucket有自己的锁: 进程内是threading.Lock,进程间是该bucket slot表字节范围上的fcntl锁.
+
+配置:
+CACHES = {
+    'shared': {
+        'BACKEND': 'DjangoBlog.mmap_cache_backend.MmapCache',
+        'LOCATION': '/dev/shm/djangoblog_cache',
+        'OPTIONS': {
+            'BUCKETS': 256,
+            # (chunk大小, 每个bucket中的数量)
+            'SLOTS': ((256, 48), (1024, 32), (4096, 12), (16384, 4), (65536, 2), (262144, 1)),
+        }
+    }
+}
+也可以用SLAB_SIZES列出每个chunk的大小,如(256, 256, 1024, 4096),与SLOTS只能配置一个.
+单个值(key加上pickle并压缩后的数据)不能超过最大的chunk,默认256KB,更大的值不写入,只记录警告,
+需要缓存更大的值(如很长的文章或全页缓存)时在SLOTS中加入更大的chunk,文件大小为BUCKETS * 所有chunk大小之和.
+修改BUCKETS或SLOTS后,下次启动时用新的文件替换旧文件,已经映射旧文件的worker不受影响,重启后使用新文件.
+读取时数据损坏(反序列化失败)视为未命中,并删除该条目.
+"""
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from hashlib import blake2b
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+
+from DjangoBlog.cache_stats import key_namespace, record
+
+try:
+    import fcntl
+except ImportError:
+    # windows下只有进程内的锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 每个bucket中(chunk大小, 数量),默认256个bucket共约2.5万个条目,文件约135MB.
+# 缓存标签的版本,文章卡片,浏览量去重,锚点等小于1KB的条目数量最多,全页缓存和列表大多在4KB到64KB之间
+DEFAULT_SLOTS = ((256, 48), (1024, 32), (4096, 12),
+                 (16384, 4), (65536, 2), (262144, 1))
+
+MAGIC = b'DJBMMAP1'
+# magic, bucket数, 每个bucket的slot数, 几何结构摘要
+HEADER = struct.Struct('<8sII16s')
+HEADER_SIZE = 64
+# key hash, key长度, value长度, 过期时间(0为永不过期), 最后访问时间, flags
+SLOT = struct.Struct('<QIIddB7x')
+
+FLAG_USED = 1
+FLAG_COMPRESSED = 2
+
+_MISSING = object()
+
+# 进程内共享的映射表,同一个文件只映射一次
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def slots_to_slab_sizes(slots):
+    """
+    把SLOTS配置展开为每个chunk的大小
+    :param slots: {chunk大小: 数量}或[(chunk大小, 数量)]
+    :return: chunk大小的tuple
+    """
+    if isinstance(slots, dict):
+        slots = slots.items()
+    sizes = []
+    for size, count in slots:
+        if int(count) <= 0:
+            raise ImproperlyConfigured(
+                'MmapCache SLOTS count must be positive')
+        sizes.extend([int(size)] * int(count))
+    return tuple(sizes)
+
+
+class _Table(object):
+    def __init__(self, path, num_buckets, slab_sizes):
+        self.path = path
+        self.num_buckets = num_buckets
+        self.slab_sizes = tuple(sorted(slab_sizes))
+        self.num_slots = len(self.slab_sizes)
+        self.slot_table_size = SLOT.size * self.num_slots
+        self.bucket_data_size = sum(self.slab_sizes)
+        self.slots_start = HEADER_SIZE
+        self.data_start = self.slots_start + \
+            self.slot_table_size * self.num_buckets
+        self.size = self.data_start + self.bucket_data_size * self.num_buckets
+        offsets = []
+        offset = 0
+        for size in self.slab_sizes:
+            offsets.append(offset)
+            offset += size
+        self.chunk_offsets = tuple(offsets)
+        self.locks = [threading.Lock() for _ in range(num_buckets)]
+        # 本线程持有锁期间被淘汰的key,释放锁之后再记录统计
+        self.evicted = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.fd = self._open_file()
+        self.mm = mmap.mmap(self.fd, self.size)
+
+    def _geometry(self):
+        return blake2b(repr((self.num_buckets, self.slab_sizes)).encode(
+            'utf-8'), digest_size=16).digest()
+
+    def _header(self):
+        return HEADER.pack(MAGIC, self.num_buckets,
+                           self.num_slots, self._geometry())
+
+    def _create_file(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        os.ftruncate(fd, self.size)
+        os.write(fd, self._header())
+        return fd
+
+    def _open_file(self):
+        """
+        打开缓存文件,文件结构不同时用新文件替换.
+        其他worker可能正在使用旧文件,截断已映射的文件会使它们访问时收到SIGBUS,所以不修改旧文件的大小
+        :return: 文件描述符
+        """
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+                # 等待锁的时候文件可能已经被其他worker替换
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    continue
+                size = os.fstat(fd).st_size
+                os.lseek(fd, 0, os.SEEK_SET)
+                if size == 0:
+                    # 新建的文件,还没有被映射
+                    logger.info('init mmap cache file:%s' % self.path)
+                    os.ftruncate(fd, self.size)
+                    os.write(fd, self._header())
+                elif size != self.size or os.read(fd, HEADER.size) != self._header():
+                    logger.info('replace mmap cache file:%s' % self.path)
+                    tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    new_fd = self._create_file(tmp_path)
+                    os.replace(tmp_path, self.path)
+                    return new_fd
+                if fcntl:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+                result, fd = fd, None
+                return result
+            finally:
+                # 关闭文件同时释放锁
+                if fd is not None:
+                    os.close(fd)
+
+    @contextmanager
+    def locked(self, bucket):
+        start = self.slots_start + bucket * self.slot_table_size
+        with self.locks[bucket]:
+            if fcntl:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX,
+                            self.slot_table_size, start)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN,
+                                self.slot_table_size, start)
+
+    def _slot_offset(self, bucket, slot):
+        return self.slots_start + bucket * self.slot_table_size + slot * SLOT.size
+
+    def _chunk_offset(self, bucket, slot):
+        return self.data_start + bucket * \
+            self.bucket_data_size + self.chunk_offsets[slot]
+
+    def read_slot(self, bucket, slot):
+        return SLOT.unpack_from(self.mm, self._slot_offset(bucket, slot))
+
+    def read_slots(self, bucket):
+        # 一次读取整个slot表,不逐个slot解析
+        start = self.slots_start + bucket * self.slot_table_size
+        return SLOT.iter_unpack(self.mm[start:start + self.slot_table_size])
+
+    def write_slot(self, bucket, slot, *values):
+        SLOT.pack_into(self.mm, self._slot_offset(bucket, slot), *values)
+
+    def free_slot(self, bucket, slot):
+        self.mm[self._slot_offset(bucket, slot):self._slot_offset(
+            bucket, slot) + SLOT.size] = bytes(SLOT.size)
+
+    def find(self, bucket, key_hash, key_bytes, now):
+        """
+        查找key所在的slot,过期的条目会被释放
+        :return: (slot, slot数据),未找到时slot为-1
+        """
+        for slot, values in enumerate(self.read_slots(bucket)):
+            h, key_len, value_len, expire, access, flags = values
+            if not flags & FLAG_USED or h != key_hash or key_len != len(
+                    key_bytes):
+                continue
+            offset = self._chunk_offset(bucket, slot)
+            if self.mm[offset:offset + key_len] != key_bytes:
+                continue
+            if expire and expire <= now:
+                self.free_slot(bucket, slot)
+                return -1, None
+            return slot, values
+        return -1, None
+
+    def read_value(self, bucket, slot, key_len, value_len):
+        offset = self._chunk_offset(bucket, slot) + key_len
+        return self.mm[offset:offset + value_len]
+
+    def touch_slot(self, bucket, slot, values, now, expire=None):
+        h, key_len, value_len, old_expire, access, flags = values
+        self.write_slot(bucket, slot, h, key_len, value_len,
+                        old_expire if expire is None else expire, now, flags)
+
+    def store(self, bucket, key_hash, key_bytes, payload, expire, flags, now):
+        """
+        写入条目,选择能放下数据的最小空闲chunk,没有空闲chunk时淘汰最久未访问的条目,
+        有过期时间的条目优先淘汰
+        :return: 是否写入成功
+        """
+        existing, values = self.find(bucket, key_hash, key_bytes, now)
+        if existing >= 0:
+            self.free_slot(bucket, existing)
+        length = len(key_bytes) + len(payload)
+        target = -1
+        # 是否不过期: (最久未访问的slot, 访问时间)
+        lru = {}
+        for slot, (size, values) in enumerate(
+                zip(self.slab_sizes, self.read_slots(bucket))):
+            if size < length:
+                continue
+            h, key_len, value_len, slot_expire, access, slot_flags = values
+            if not slot_flags & FLAG_USED or (
+                    slot_expire and slot_expire <= now):
+                target = slot
+                break
+            persistent = not slot_expire
+            if persistent not in lru or access < lru[persistent][1]:
+                lru[persistent] = (slot, access)
+        if target < 0 and lru:
+            target = (lru.get(False) or lru[True])[0]
+            h, key_len, value_len, slot_expire, access, slot_flags = self.read_slot(
+                bucket, target)
+            offset = self._chunk_offset(bucket, target)
+            self.pop_evicted().append(self.mm[offset:offset + key_len])
+        if target < 0:
+            return False
+        offset = self._chunk_offset(bucket, target)
+        self.mm[offset:offset + len(key_bytes)] = key_bytes
+        self.mm[offset + len(key_bytes):offset + length] = payload
+        self.write_slot(bucket, target, key_hash, len(key_bytes),
+                        len(payload), expire, now, flags | FLAG_USED)
+        return True
+
+    def pop_evicted(self):
+        keys = getattr(self.evicted, 'keys', None)
+        if keys is None:
+            keys = self.evicted.keys = []
+        return keys
+
+    def clear(self):
+        for bucket in range(self.num_buckets):
+            with self.locked(bucket):
+                start = self.slots_start + bucket * self.slot_table_size
+                self.mm[start:start + self.slot_table_size] = bytes(
+                    self.slot_table_size)
+
+
+def _get_table(path, num_buckets, slab_sizes):
+    with _tables_lock:
+        table = _tables.get(path)
+        if table is None:
+            table = _tables[path] = _Table(path, num_buckets, slab_sizes)
+        return table
+
+
+class MmapCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location or os.path.join(
+            tempfile.gettempdir(), 'djangoblog_cache.mmap')
+        self._num_buckets = int(options.get('BUCKETS', 256))
+        if 'SLOTS' in options and 'SLAB_SIZES' in options:
+            raise ImproperlyConfigured(
+                'MmapCache accepts only one of SLOTS and SLAB_SIZES')
+        if 'SLAB_SIZES' in options:
+            self._slab_sizes = tuple(int(size)
+                                     for size in options['SLAB_SIZES'])
+        else:
+            self._slab_sizes = slots_to_slab_sizes(
+                options.get('SLOTS', DEFAULT_SLOTS))
+        if not self._slab_sizes or min(self._slab_sizes) <= 0:
+            raise ImproperlyConfigured(
+                'MmapCache SLOTS must be a list of positive sizes')
+        self._compress_min_length = int(
+            options.get('COMPRESS_MIN_LENGTH', 1024))
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = _get_table(
+                self._path, self._num_buckets, self._slab_sizes)
+        return self._table
+
+    @property
+    def max_value_size(self):
+        """
+        能缓存的最大条目(key加上序列化之后的值)字节数
+        """
+        return max(self._slab_sizes)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        key_bytes = key.encode('utf-8')
+        key_hash = int.from_bytes(
+            blake2b(key_bytes, digest_size=8).digest(), 'little')
+        return key_bytes, key_hash, key_hash % self._num_buckets
+
+    def _expire(self, timeout):
+        expire = self.get_backend_timeout(timeout)
+        return 0.0 if expire is None else expire
+
+    def _dumps(self, value):
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(payload) >= self._compress_min_length:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                return compressed, FLAG_COMPRESSED
+        return payload, 0
+
+    @staticmethod
+    def _loads(payload, flags):
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+    def _load_or_miss(self, key, version, result):
+        """
+        反序列化读取的数据,数据损坏时删除条目并视为未命中
+        :return: 未命中返回_MISSING
+        """
+        try:
+            return self._loads(*result)
+        except Exception as e:
+            logger.warning('mmap cache load failed:%s %r' % (key, e))
+            self.delete(key, version=version)
+            return _MISSING
+
+    def _get_payload(self, table, key_bytes, key_hash, bucket, now):
+        slot, values = table.find(bucket, key_hash, key_bytes, now)
+        if slot < 0:
+            return None
+        h, key_len, value_len, expire, access, flags = values
+        payload = table.read_value(bucket, slot, key_len, value_len)
+        table.touch_slot(bucket, slot, values, now)
+        return payload, flags
+
+    def _record_evictions(self, table):
+        keys = table.pop_evicted()
+        while keys:
+            # 去掉make_key添加的前缀和版本
+            key = keys.pop().decode('utf-8', 'replace').split(':', 2)[-1]
+            record(key_namespace(key), 'evictions')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        payload, flags = self._dumps(value)
+        table = self.table
+        now = time.time()
+        with table.locked(bucket):
+            if table.find(bucket, key_hash, key_bytes, now)[0] >= 0:
+                return False
+            stored = table.store(bucket, key_hash, key_bytes, payload,
+                                 self._expire(timeout), flags, now)
+        self._record_evictions(table)
+        return stored
+
+    def get(self, key, default=None, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        table = self.table
+        with table.locked(bucket):
+            result = self._get_payload(
+                table, key_bytes, key_hash, bucket, time.time())
+        if result is None:
+            return default
+        value = self._load_or_miss(key, version, result)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        payload, flags = self._dumps(value)
+        table = self.table
+        now = time.time()
+        with table.locked(bucket):
+            stored = table.store(bucket, key_hash, key_bytes, payload,
+                                 self._expire(timeout), flags, now)
+        self._record_evictions(table)
+        if not stored:
+            logger.warning(
+                'mmap cache value too large:%s length:%d max:%d, add a larger size to SLOTS' %
+                (key, len(key_bytes) + len(payload), self.max_value_size))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        table = self.table
+        now = time.time()
+        with table.locked(bucket):
+            slot, values = table.find(bucket, key_hash, key_bytes, now)
+            if slot < 0:
+                return False
+            table.touch_slot(bucket, slot, values, now, self._expire(timeout))
+            return True
+
+    def delete(self, key, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        table = self.table
+        with table.locked(bucket):
+            slot, values = table.find(bucket, key_hash, key_bytes, time.time())
+            if slot < 0:
+                return False
+            table.free_slot(bucket, slot)
+            return True
+
+    def has_key(self, key, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        table = self.table
+        with table.locked(bucket):
+            return table.find(bucket, key_hash,
+                              key_bytes, time.time())[0] >= 0
+
+    def incr(self, key, delta=1, version=None):
+        key_bytes, key_hash, bucket = self._key(key, version)
+        table = self.table
+        now = time.time()
+        with table.locked(bucket):
+            slot, values = table.find(bucket, key_hash, key_bytes, now)
+            if slot < 0:
+                raise ValueError("Key '%s' not found" % key)
+            h, key_len, value_len, expire, access, flags = values
+            try:
+                value = self._loads(table.read_value(
+                    bucket, slot, key_len, value_len), flags) + delta
+            except Exception as e:
+                # 数据损坏时与key不存在一样处理
+                logger.warning('mmap cache load failed:%s %r' % (key, e))
+                table.free_slot(bucket, slot)
+                raise ValueError("Key '%s' not found" % key)
+            payload, flags = self._dumps(value)
+            table.store(bucket, key_hash, key_bytes,
+                        payload, expire, flags, now)
+        self._record_evictions(table)
+        return value
+
+    def _group_by_bucket(self, keys, version):
+        buckets = {}
+        for key in keys:
+            key_bytes, key_hash, bucket = self._key(key, version)
+            buckets.setdefault(bucket, []).append((key, key_bytes, key_hash))
+        return buckets
+
+    def get_many(self, keys, version=None):
+        found = {}
+        table = self.table
+        for bucket, items in self._group_by_bucket(keys, version).items():
+            with table.locked(bucket):
+                now = time.time()
+                payloads = [(key, self._get_payload(table, key_bytes, key_hash, bucket, now))
+                            for key, key_bytes, key_hash in items]
+            for key, result in payloads:
+                if result is not None:
+                    value = self._load_or_miss(key, version, result)
+                    if value is not _MISSING:
+                        found[key] = value
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = []
+        expire = self._expire(timeout)
+        table = self.table
+        for bucket, items in self._group_by_bucket(data, version).items():
+            payloads = [(key, key_bytes, key_hash) + self._dumps(data[key])
+                        for key, key_bytes, key_hash in items]
+            with table.locked(bucket):
+                now = time.time()
+                for key, key_bytes, key_hash, payload, flags in payloads:
+                    if not table.store(bucket, key_hash, key_bytes,
+                                       payload, expire, flags, now):
+                        failed_keys.append(key)
+            self._record_evictions(table)
+        return failed_keys
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.delete(key, version=version)
+
+    def clear(self):
+        self.table.clear()
@@ -66,6 +66,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'blog.middleware.RequestMemoMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.gzip.GZipMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',
@@ -74,9 +75,12 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # 放在PageCacheMiddleware之前,缓存的页面中保留占位符,每次请求替换为本次的耗时
+    'blog.middleware.OnlineMiddleware',
+    'blog.middleware.ArticleViewMiddleware',
+    'blog.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
-    'blog.middleware.OnlineMiddleware'
 ]
 
 ROOT_URLCONF = 'DjangoBlog.urls'
@@ -192,15 +196,92 @@ BOOTSTRAP_COLOR_TYPES = [
 # paginate
 PAGINATE_BY = 10
 # http cache timeout
-CACHE_CONTROL_MAX_AGE = 2592000
+# 各类页面Cache-Control的max-age,过期后浏览器用ETag/Last-Modified验证,登录用户不使用共享缓存
+CACHE_CONTROL_MAX_AGE = {
+    'default': 0,
+    'article': 60 * 10,
+    'page': 60 * 60,
+    'list': 60,
+    'feed': 60 * 60,
+    'sitemap': 60 * 60 * 24,
+}
 # cache setting
+# default记录统计后转发给twotier, twotier是两级缓存: 进程内LRU + 多个worker共享的shared缓存
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'DjangoBlog.instrumented_cache_backend.InstrumentedCache',
+        'OPTIONS': {
+            'CACHE': 'twotier',
+            'STATS_CACHE': 'shared',
+            'FLUSH_INTERVAL': 10,
+            'SIZE_SAMPLE_RATE': 10,
+        }
+    },
+    'twotier': {
+        'BACKEND': 'DjangoBlog.twotier_cache_backend.TwoTierCache',
         'TIMEOUT': 1080,
         'LOCATION': 'unique-snowflake',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+            'GENERATION_CHECK_INTERVAL': 1,
+        }
+    },
+    'shared': {
+        'BACKEND': 'DjangoBlog.mmap_cache_backend.MmapCache',
+        'TIMEOUT': 1080,
+        'LOCATION': os.environ.get('DJANGO_MMAP_CACHE_LOCATION') or os.path.join(BASE_DIR, 'filecache', 'shared.mmap'),
+        'OPTIONS': {
+            'BUCKETS': int(os.environ.get('DJANGO_MMAP_CACHE_BUCKETS') or 256),
+        }
     }
 }
+if os.environ.get('DJANGO_MMAP_CACHE_SLOTS'):
+    # 每个bucket中每种chunk的大小和数量,如256:48,1024:32,最大的chunk是能缓存的最大值,
+    # 默认见DjangoBlog.mmap_cache_backend.DEFAULT_SLOTS
+    CACHES['shared']['OPTIONS']['SLOTS'] = [
+        tuple(int(n) for n in item.split(':')) for item in os.environ.get('DJANGO_MMAP_CACHE_SLOTS').split(',')]
+elif os.environ.get('DJANGO_MMAP_CACHE_SLAB_SIZES'):
+    # 每个bucket的chunk大小,逗号分隔
+    CACHES['shared']['OPTIONS']['SLAB_SIZES'] = [
+        int(size) for size in os.environ.get('DJANGO_MMAP_CACHE_SLAB_SIZES').split(',')]
+if TESTING:
+    import tempfile
+
+    CACHES['shared']['LOCATION'] = os.path.join(
+        tempfile.mkdtemp(prefix='djangoblog_test_cache_'), 'shared.mmap')
+elif os.environ.get('DJANGO_FILE_CACHE_LOCATION'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'TIMEOUT': 1080,
+        'LOCATION': os.environ.get('DJANGO_FILE_CACHE_LOCATION'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
+    }
+if os.environ.get('DJANGO_MEMCACHED_LOCATION'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'TIMEOUT': 1080,
+        'LOCATION': os.environ.get('DJANGO_MEMCACHED_LOCATION'),
+    }
+
+# 全页缓存时间,页面依赖的模型写入后缓存立即失效
+PAGE_CACHE_TIMEOUT = 60 * 60 * 10
+
+# worker启动时在后台预热缓存,同一台机器上只有一个worker会执行
+WARM_CACHE_ON_BOOT = env_to_bool('DJANGO_WARM_CACHE_ON_BOOT', False)
+WARM_CACHE_CONCURRENCY = int(os.environ.get('DJANGO_WARM_CACHE_CONCURRENCY') or 4)
+
+# 文章浏览量先在进程内累加,每隔VIEW_COUNT_FLUSH_INTERVAL秒一次写入数据库
+# 同一访客VIEW_COUNT_DEDUPE_WINDOW秒内重复访问同一篇文章只计一次
+VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('DJANGO_VIEW_COUNT_FLUSH_INTERVAL') or 30)
+VIEW_COUNT_DEDUPE_WINDOW = int(os.environ.get('DJANGO_VIEW_COUNT_DEDUPE_WINDOW') or 60 * 30)
+# 热门文章: 分数的半衰期(秒),保存的文章数,侧边栏最多每隔多少秒随排名更新一次
+POPULAR_ARTICLES_HALF_LIFE = int(os.environ.get('DJANGO_POPULAR_ARTICLES_HALF_LIFE') or 60 * 60 * 24 * 7)
+POPULAR_ARTICLES_TOP_K = int(os.environ.get('DJANGO_POPULAR_ARTICLES_TOP_K') or 50)
+POPULAR_ARTICLES_REFRESH_INTERVAL = int(os.environ.get('DJANGO_POPULAR_ARTICLES_REFRESH_INTERVAL') or 60 * 60)
 
 SITE_ID = 1
 
@@ -18,6 +18,9 @@ from blog.models import Article, Category, Tag
 from accounts.models import BlogUser
 from django.contrib.sitemaps import GenericSitemap
 from django.urls import reverse
+from django.contrib.sitemaps.views import sitemap
+from django.views.decorators.http import condition
+from DjangoBlog.utils import get_page_etag, patch_cache_control_policy
 
 
 class StaticViewSitemap(Sitemap):
@@ -73,3 +76,17 @@ class UserSiteMap(Sitemap):
 
     def lastmod(self, obj):
         return obj.date_joined
+
+
+def sitemap_etag(request, *args, **kwargs):
+    return get_page_etag(
+        ('blog.article', 'blog.category', 'blog.tag', 'accounts.bloguser'))
+
+
+def conditional_sitemap(request, *args, **kwargs):
+    """
+    sitemap内容未改变时直接返回304,不需要重新生成
+    """
+    response = condition(etag_func=sitemap_etag)(
+        sitemap)(request, *args, **kwargs)
+    return patch_cache_control_policy(request, response, 'sitemap')
@@ -49,8 +49,267 @@ class DjangoBlogTest(TestCase):
         }
         data = parse_dict_to_url(d)
         self.assertIsNotNone(data)
+        # 相同的markdown和代码块只渲染一次
+        from unittest import mock
+        from DjangoBlog import utils
+        with mock.patch.object(utils, 'highlight', wraps=utils.highlight) as highlight:
+            html1 = CommonMarkdown.get_markdown('```python\nimport sys\n```')
+            html2 = CommonMarkdown.get_markdown('text\n\n```python\nimport sys\n```')
+            CommonMarkdown.get_markdown('```python\nimport sys\n```')
+            self.assertEqual(highlight.call_count, 1)
+        self.assertIn(html1, html2)
         render = BlogMarkDownRenderer()
         s = render.autolink('http://www.baidu.com')
         self.assertTrue(s.find('nofollow') > 0)
         s = render.link('http://www.baidu.com', 'test', 'test')
         self.assertTrue(s.find('nofollow') > 0)
+
+    def test_current_site(self):
+        from unittest import mock
+        from django.contrib.sites.models import Site
+        from DjangoBlog import utils
+        self.addCleanup(Site.objects.clear_cache)
+        self.addCleanup(clear_current_site)
+        site = get_current_site()
+        # 进程内读取,不访问数据库和缓存
+        with self.assertNumQueries(0), mock.patch.object(utils, 'cache') as mock_cache:
+            self.assertIs(get_current_site(), site)
+            self.assertFalse(mock_cache.method_calls)
+
+        site.domain = 'www.example.com'
+        site.save()
+        self.assertEqual(get_current_site().domain, 'www.example.com')
+        render = BlogMarkDownRenderer()
+        self.assertFalse('nofollow' in render.link('https://www.example.com/', None, 'test'))
+
+        # 其他worker修改了站点
+        Site.objects.filter(pk=site.pk).update(domain='blog.example.com')
+        invalidate_cache_tags(Site)
+        self.assertEqual(get_current_site().domain, 'www.example.com')
+        with mock.patch.object(utils.time, 'monotonic',
+                               return_value=time.monotonic() + SITE_VERSION_CHECK_INTERVAL + 1):
+            self.assertEqual(get_current_site().domain, 'blog.example.com')
+        html = CommonMarkdown.get_markdown('[a](https://blog.example.com/) [b](https://www.baidu.com/)')
+        self.assertEqual(html.count('nofollow'), 1)
+
+    def test_request_memo(self):
+        calls = []
+
+        @request_memoize
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        square(2)
+        square(2)
+        self.assertEqual(len(calls), 2)
+        begin_request_memo()
+        try:
+            self.assertEqual(square(2), 4)
+            self.assertEqual(square(2), 4)
+            self.assertEqual(square(3), 9)
+            # 参数不能hash时直接调用
+            self.assertEqual(request_memoize(len)([1, 2]), 2)
+        finally:
+            end_request_memo()
+        self.assertEqual(calls, [2, 2, 2, 3])
+
+    def test_cache_tags(self):
+        from blog.models import BlogSettings
+        version = get_cache_tags_version(('blog.article', 'blog.tag'))
+        self.assertEqual(version, get_cache_tags_version(('blog.tag', 'blog.article')))
+        invalidate_cache_tags(Article)
+        self.assertNotEqual(version, get_cache_tags_version(('blog.article', 'blog.tag')))
+        # 其他进程同时初始化同一个标签时,使用先写入的版本
+        from unittest import mock
+        cache.set(CACHE_TAG_VERSION_PREFIX + 'racetag', 'winner', None)
+        get_many = cache.get_many
+        results = [{}]
+        with mock.patch.object(cache, 'get_many', side_effect=lambda keys: results.pop() if results else get_many(keys)):
+            self.assertEqual({'racetag': 'winner'}, get_cache_tag_versions(('racetag',)))
+
+        calls = []
+
+        @cache_decorator(depends_on=('blog.tag',))
+        def tag_names():
+            calls.append(1)
+            return [t.name for t in Tag.objects.all()]
+
+        tag_names()
+        tag_names()
+        self.assertEqual(1, len(calls))
+        Tag.objects.create(name='cachetag')
+        self.assertEqual(['cachetag'], tag_names())
+        self.assertEqual(2, len(calls))
+
+        setting = get_blog_setting()
+        setting.sitename = 'cachetest'
+        setting.save()
+        self.assertEqual('cachetest', get_blog_setting().sitename)
+
+    def test_cache_decorator_stale(self):
+        import time
+        calls = []
+
+        @cache_decorator(depends_on=('blog.category',), single_flight=True,
+                         soft_expiration=0.01, stale_if_error=True)
+        def category_count():
+            calls.append(1)
+            if len(calls) > 2:
+                raise ValueError('db down')
+            return Category.objects.count() + len(calls)
+
+        self.assertEqual(1, category_count())
+        time.sleep(0.02)
+        # 软过期后刷新
+        self.assertEqual(2, category_count())
+        invalidate_cache_tags(Category)
+        # 刷新出错返回最近一次成功的结果
+        self.assertEqual(2, category_count())
+        self.assertEqual(3, len(calls))
+
+    def test_get_or_compute(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(1, get_or_compute('single_flight:1', compute, 60, stale_key='single_flight:stale'))
+        self.assertEqual(1, get_or_compute('single_flight:1', compute, 60, stale_key='single_flight:stale'))
+        # 其他worker正在重新计算时返回旧值
+        cache.add('single_flight:2:compute', 1, 10)
+        self.assertEqual(1, get_or_compute('single_flight:2', compute, 60, stale_key='single_flight:stale'))
+        self.assertEqual(1, len(calls))
+        cache.delete('single_flight:2:compute')
+        self.assertEqual(2, get_or_compute('single_flight:2', compute, 60, stale_key='single_flight:stale'))
+        self.assertIsNone(cache.get('single_flight:2:compute'))
+
+    def test_make_cache_key(self):
+        category = Category.objects.create(name='keycategory')
+        key = make_cache_key(Category.get_sub_categorys, (category,), {})
+        self.assertTrue(key.startswith(
+            'blog.category:{pk}:get_sub_categorys:'.format(pk=category.pk)))
+        self.assertEqual(key, make_cache_key(
+            Category.get_sub_categorys, (Category.objects.get(pk=category.pk),), {}))
+        self.assertNotEqual(key, make_cache_key(
+            Category.get_sub_categorys, (category,), {'depth': 1}))
+
+    def test_twotier_cache(self):
+        from DjangoBlog.twotier_cache_backend import TwoTierCache
+        params = {'OPTIONS': {'L2': 'shared', 'GENERATION_CHECK_INTERVAL': 0}}
+        # 两个worker,各自的L1,共享L2
+        worker1 = TwoTierCache('worker1', params)
+        worker2 = TwoTierCache('worker2', params)
+        worker1.set('twotier:key', ['value1'])
+        self.assertEqual(['value1'], worker2.get('twotier:key'))
+        value = worker1.get('twotier:key')
+        self.assertIs(value, worker1.get('twotier:key'))
+        worker2.set('twotier:key', ['value2'])
+        self.assertEqual(['value2'], worker1.get('twotier:key'))
+        self.assertEqual({'twotier:key': ['value2']},
+                         worker1.get_many(['twotier:key', 'twotier:none']))
+        # 写入新的key不会使其他worker的L1失效
+        value = worker2.get('twotier:key')
+        worker1.set('twotier:fresh', ['fresh'])
+        worker1.set_many({'twotier:fresh2': ['fresh']})
+        self.assertIs(value, worker2.get('twotier:key'))
+        worker1.delete('twotier:key')
+        self.assertIsNone(worker2.get('twotier:key'))
+
+    def test_mmap_cache(self):
+        import os
+        import tempfile
+        import time
+        from DjangoBlog import mmap_cache_backend
+        from DjangoBlog.mmap_cache_backend import MmapCache
+        location = os.path.join(tempfile.mkdtemp(), 'test.mmap')
+        params = {'OPTIONS': {'BUCKETS': 1, 'SLAB_SIZES': (128, 128, 1024)}}
+        mmap_cache = MmapCache(location, params)
+        mmap_cache.set('key1', 'value1')
+        self.assertEqual('value1', mmap_cache.get('key1'))
+        self.assertFalse(mmap_cache.add('key1', 'value2'))
+        self.assertEqual(
+            [], mmap_cache.set_many({'key2': 'value2', 'key3': 'value3'}))
+        self.assertEqual({'key1': 'value1', 'key3': 'value3'},
+                         mmap_cache.get_many(['key1', 'key3', 'key4']))
+        # 只有三个chunk,淘汰最久未访问的key2
+        mmap_cache.set('key4', 'value4')
+        self.assertIsNone(mmap_cache.get('key2'))
+        self.assertEqual('value4', mmap_cache.get('key4'))
+        # 超过最大chunk的值不缓存
+        mmap_cache.set('key1', 'x' * 2048)
+        self.assertEqual('x' * 2048, mmap_cache.get('key1'))
+        mmap_cache.set('key1', os.urandom(2048))
+        self.assertIsNone(mmap_cache.get('key1'))
+        mmap_cache.set('counter', 1, 0)
+        self.assertIsNone(mmap_cache.get('counter'))
+        mmap_cache.set('counter', 1)
+        self.assertEqual(3, mmap_cache.incr('counter', 2))
+        # worker重启后重新映射同一个文件
+        mmap_cache_backend._tables.pop(location)
+        restarted = MmapCache(location, params)
+        self.assertEqual(3, restarted.get('counter'))
+        # 数据损坏视为未命中
+        key_bytes, key_hash, bucket = restarted._key('counter', None)
+        table = restarted.table
+        slot, values = table.find(bucket, key_hash, key_bytes, time.time())
+        offset = table._chunk_offset(bucket, slot) + values[1]
+        table.mm[offset:offset + values[2]] = bytes(values[2])
+        self.assertIsNone(restarted.get('counter'))
+        self.assertEqual({}, restarted.get_many(['counter']))
+        restarted.set('key1', 'value1')
+        # 修改SLAB_SIZES后替换文件,已经映射旧文件的worker不受影响
+        mmap_cache_backend._tables.pop(location)
+        resized = MmapCache(location, {'OPTIONS': {'BUCKETS': 1, 'SLAB_SIZES': (128, 4096)}})
+        self.assertEqual(4096, resized.max_value_size)
+        self.assertIsNone(resized.get('key1'))
+        self.assertEqual('value1', restarted.get('key1'))
+        resized.set('key1', 'x' * 3000)
+        self.assertEqual('x' * 3000, resized.get('key1'))
+        restarted.clear()
+        self.assertIsNone(restarted.get('key1'))
+        # 按SLOTS配置每种chunk的数量,bucket写满后优先淘汰有过期时间的条目,缓存标签的版本不丢失
+        mmap_cache_backend._tables.pop(location)
+        slotted = MmapCache(location, {'OPTIONS': {'BUCKETS': 1, 'SLOTS': ((128, 4), (1024, 2))}})
+        self.assertEqual((128, 128, 128, 128, 1024, 1024), slotted.table.slab_sizes)
+        versions = {'cache_tag_version:blog.article': 'abc', 'cache_tag_version:blog.tag': 'def'}
+        self.assertEqual([], slotted.set_many(versions, None))
+        for i in range(20):
+            slotted.set('article_card:%d' % i, 'card', 60)
+        self.assertEqual(versions, slotted.get_many(list(versions)))
+        self.assertEqual('card', slotted.get('article_card:19'))
+        self.assertIsNone(slotted.get('article_card:0'))
+
+    def test_cache_stats(self):
+        from django.core.management import call_command
+        from DjangoBlog.cache_stats import get_stats, key_namespace, reset_stats
+        self.assertEqual('blog.article:get_category_tree',
+                         key_namespace('blog.article:1:get_category_tree:abc:def'))
+        self.assertEqual('DjangoBlog.utils:get_current_site',
+                         key_namespace('DjangoBlog.utils:get_current_site:abc'))
+        self.assertEqual('template.cache.sidebar',
+                         key_namespace('template.cache.sidebar.abc'))
+        self.assertEqual('gravatat', key_namespace('gravatat/a@b.com'))
+        reset_stats()
+        self.assertIsNone(cache.get('stats_test:1'))
+        cache.set('stats_test:1', 'value')
+        cache.get('stats_test:1')
+        stats = {item['namespace']: item for item in get_stats()}
+        self.assertEqual(1, stats['stats_test']['hits'])
+        self.assertEqual(1, stats['stats_test']['misses'])
+        self.assertEqual(1, stats['stats_test']['computes'])
+        self.assertTrue(stats['stats_test']['avg_bytes'] > 0)
+        # 值的大小按SIZE_SAMPLE_RATE抽样
+        for i in range(10):
+            cache.set('stats_test:2', 'value')
+        stats = {item['namespace']: item for item in get_stats()}
+        self.assertEqual(11, stats['stats_test']['sets'])
+        self.assertEqual(2, stats['stats_test']['sized_sets'])
+        call_command('cache_stats')
+
+        user = get_user_model().objects.create_superuser(
+            email="liangliangyy1@gmail.com", username="liangliangyy1", password="liangliangyy1")
+        self.client.login(username='liangliangyy1', password='liangliangyy1')
+        response = self.client.get('/admin/cache_stats/')
+        self.assertContains(response, 'stats_test')
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: twotier_cache_backend.py
+@time: 2026/10/18
+
+两级缓存.
+L1是进程内有容量上限的LRU,直接保存python对象,不需要反序列化.
+L2是多个worker共享的缓存(memcached,文件缓存等),通过settings.CACHES中的别名配置.
+每个key按命名空间(第一个':'之前的部分)维护一个保存在L2中的generation,
+覆盖或删除L2中已有的key时改变对应命名空间的generation,其余worker在下一个请求(或GENERATION_CHECK_INTERVAL秒后)
+发现generation改变,丢弃该命名空间下的L1条目.
+写入L2中还没有的key(如带版本号的新key)不改变generation,其他worker的L1中不会有这个key.
+L2淘汰了某个key之后再写入时,其他worker的L1中的旧值最多保留L1_TIMEOUT秒.
+
+配置:
+CACHES = {
+    'default': {
+        'BACKEND': 'DjangoBlog.twotier_cache_backend.TwoTierCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+            'GENERATION_CHECK_INTERVAL': 1,
+        }
+    },
+    'shared': {...}
+}
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import sha1
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.signals import request_started
+
+# 进程内共享的L1,同一进程的所有线程共用
+_l1_caches = {}
+_l1_locks = {}
+
+_MISSING = object()
+
+
+class TwoTierCache(BaseCache):
+    generation_key_prefix = 'twotier_generation:'
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = int(options.get('L1_TIMEOUT', 60))
+        self._check_interval = float(
+            options.get('GENERATION_CHECK_INTERVAL', 1))
+        name = location or 'twotier'
+        self._l1 = _l1_caches.setdefault(name, OrderedDict())
+        self._lock = _l1_locks.setdefault(name, threading.Lock())
+        # 本实例已确认的generation: namespace -> (generation, 下次检查时间)
+        self._generations = {}
+        request_started.connect(self._reset_generations)
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _reset_generations(self, **kwargs):
+        self._generations = {}
+
+    @staticmethod
+    def _namespace(key):
+        namespace = str(key).split(':', 1)[0]
+        if len(namespace) > 64:
+            namespace = sha1(namespace.encode('utf-8')).hexdigest()
+        return namespace
+
+    def _generation(self, namespace):
+        now = time.monotonic()
+        item = self._generations.get(namespace)
+        if item is not None and item[1] > now:
+            return item[0]
+        generation_key = self.generation_key_prefix + namespace
+        generation = self.l2.get(generation_key)
+        if generation is None:
+            # generation丢失时使用随机值,不会与之前的L1条目相同
+            self.l2.add(generation_key, uuid.uuid4().hex[:8], None)
+            generation = self.l2.get(generation_key)
+        self._generations[namespace] = (generation, now + self._check_interval)
+        return generation
+
+    def _bump_generation(self, namespace):
+        generation = uuid.uuid4().hex[:8]
+        self.l2.set(self.generation_key_prefix + namespace, generation, None)
+        self._generations[namespace] = (
+            generation, time.monotonic() + self._check_interval)
+        return generation
+
+    def _resolve_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _l1_get(self, key, version):
+        """
+        :return: (value, generation),未命中时value为_MISSING
+        """
+        l1_key = self.make_key(key, version)
+        generation = self._generation(self._namespace(key))
+        with self._lock:
+            entry = self._l1.get(l1_key)
+            if entry is not None:
+                value, expire_at, entry_generation = entry
+                if entry_generation == generation and expire_at > time.monotonic():
+                    self._l1.move_to_end(l1_key)
+                    return value, generation
+                del self._l1[l1_key]
+        return _MISSING, generation
+
+    def _l1_set(self, key, version, value, timeout, generation):
+        l1_key = self.make_key(key, version)
+        if timeout is None:
+            timeout = self._l1_timeout
+        timeout = min(timeout, self._l1_timeout)
+        with self._lock:
+            if timeout <= 0:
+                self._l1.pop(l1_key, None)
+                return
+            self._l1[l1_key] = (value, time.monotonic() + timeout, generation)
+            self._l1.move_to_end(l1_key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key, version):
+        with self._lock:
+            self._l1.pop(self.make_key(key, version), None)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._resolve_timeout(timeout)
+        if not self.l2.add(key, value, timeout, version=version):
+            return False
+        # L2中原来没有这个key,不需要使其他worker的L1失效
+        generation = self._generation(self._namespace(key))
+        self._l1_set(key, version, value, timeout, generation)
+        return True
+
+    def get(self, key, default=None, version=None):
+        value, generation = self._l1_get(key, version)
+        if value is not _MISSING:
+            return value
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            return default
+        self._l1_set(key, version, value, None, generation)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._resolve_timeout(timeout)
+        namespace = self._namespace(key)
+        if self.l2.add(key, value, timeout, version=version):
+            generation = self._generation(namespace)
+        else:
+            # 覆盖已有的值,其他worker的L1中可能有旧值
+            self.l2.set(key, value, timeout, version=version)
+            generation = self._bump_generation(namespace)
+        self._l1_set(key, version, value, timeout, generation)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(
+            key, self._resolve_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        result = self.l2.delete(key, version=version)
+        if result is not False:
+            self._bump_generation(self._namespace(key))
+        self._l1_delete(key, version)
+        return result
+
+    def has_key(self, key, version=None):
+        value, generation = self._l1_get(key, version)
+        return value is not _MISSING or self.l2.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        generation = self._bump_generation(self._namespace(key))
+        self._l1_set(key, version, value, None, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = {}
+        for key in keys:
+            value, generation = self._l1_get(key, version)
+            if value is _MISSING:
+                missing[key] = generation
+            else:
+                found[key] = value
+        if missing:
+            values = self.l2.get_many(list(missing), version=version)
+            for key, value in values.items():
+                self._l1_set(key, version, value, None, missing[key])
+                found[key] = value
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._resolve_timeout(timeout)
+        # 只有覆盖已有值的命名空间需要改变generation
+        existing = self.l2.get_many(list(data), version=version)
+        failed_keys = self.l2.set_many(data, timeout, version=version)
+        generations = {}
+        for namespace in set(self._namespace(key) for key in existing):
+            generations[namespace] = self._bump_generation(namespace)
+        for key, value in data.items():
+            namespace = self._namespace(key)
+            if namespace not in generations:
+                generations[namespace] = self._generation(namespace)
+            if key not in failed_keys:
+                self._l1_set(key, version, value,
+                             timeout, generations[namespace])
+        return failed_keys
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        for namespace in set(self._namespace(key) for key in keys):
+            self._bump_generation(namespace)
+        for key in keys:
+            self._l1_delete(key, version)
+
+    def clear(self):
+        self.l2.clear()
+        with self._lock:
+            self._l1.clear()
+        self._generations = {}
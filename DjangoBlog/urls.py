@@ -15,8 +15,8 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from DjangoBlog.sitemap import StaticViewSitemap, ArticleSiteMap, CategorySiteMap, TagSiteMap, UserSiteMap
+from DjangoBlog.sitemap import conditional_sitemap
 from DjangoBlog.feeds import DjangoBlogFeed
 from django.views.decorators.cache import cache_page
 from django.conf import settings
@@ -45,7 +45,7 @@ urlpatterns = [
     url(r'', include('comments.urls', namespace='comment')),
     url(r'', include('accounts.urls', namespace='account')),
     url(r'', include('oauth.urls', namespace='oauth')),
-    url(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps},
+    url(r'^sitemap\.xml$', conditional_sitemap, {'sitemaps': sitemaps},
         name='django.contrib.sitemaps.views.sitemap'),
     url(r'^feed/$', DjangoBlogFeed()),
     url(r'^rss/$', DjangoBlogFeed()),
@@ -6,17 +6,27 @@ import logging
 import os
 import random
 import string
+import threading
+import time
 import uuid
+from collections import namedtuple
+from functools import lru_cache, wraps
 from hashlib import sha256
+from html import unescape
 
 import mistune
 import requests
 from django.contrib.sites.models import Site
 from django.core.cache import cache
+from django.db.models import Model
+from django.utils.html import strip_tags
 from mistune import escape, escape_link
 from pygments import highlight
 from pygments.formatters import html
 from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from DjangoBlog import cache_stats
 
 logger = logging.getLogger(__name__)
 
@@ -32,8 +42,302 @@ def get_sha256(str):
     return m.hexdigest()
 
 
-def cache_decorator(expiration=3 * 60):
+# 缓存依赖标签的版本号key前缀
+CACHE_TAG_VERSION_PREFIX = 'cache_tag_version:'
+
+# 模板片段缓存声明的依赖,模板中通过 fragment_cache_version 取得版本号作为vary_on
+CACHE_FRAGMENT_DEPENDS_ON = {
+    'sidebar': (
+        'blog.article',
+        'blog.category',
+        'blog.tag',
+        'blog.sidebar',
+        'blog.links',
+        'blog.blogsettings',
+        'blog.popular_articles'),
+    'nav': ('blog.page',),
+    'metainfo': (),
+    'breadcrumb': ('blog.category', 'blog.blogsettings'),
+    'article_comments': ('comments.comment',),
+}
+
+
+def make_cache_tag(obj):
+    """
+    获得缓存依赖标签
+    :param obj: 字符串,模型类,模型实例或blog.records中的记录. Article -> blog.article, article -> blog.article:1
+    :return:
+    """
+    if isinstance(obj, str):
+        return obj.lower()
+    tag = '{app}.{model}'.format(
+        app=obj._meta.app_label, model=obj._meta.model_name)
+    if isinstance(obj, type):
+        return tag
+    return '{tag}:{pk}'.format(tag=tag, pk=obj.pk)
+
+
+def get_cache_tag_versions(depends_on):
+    """
+    一次获得多个依赖标签各自的版本号
+    :param depends_on: 依赖的标签,模型类或模型实例
+    :return: {标签: 版本号}
+    """
+    tags = set(make_cache_tag(d) for d in depends_on)
+    if not tags:
+        return {}
+    keys = [CACHE_TAG_VERSION_PREFIX + t for t in tags]
+    versions = cache.get_many(keys)
+    missing = {k: uuid.uuid4().hex[:8] for k in keys if k not in versions}
+    if missing:
+        # 其他进程可能同时初始化同一个标签,只有第一个写入生效,重新读取使所有进程使用同一个版本
+        for k, v in missing.items():
+            cache.add(k, v, None)
+        missing.update(cache.get_many(list(missing)))
+        versions.update(missing)
+    return {t: versions[CACHE_TAG_VERSION_PREFIX + t] for t in tags}
+
+
+def get_cache_tags_version(depends_on):
+    """
+    获得一组依赖标签当前的版本号,依赖失效后版本号改变,旧的缓存key不再被命中
+    :param depends_on: 依赖的标签,模型类或模型实例
+    :return: 版本字符串
+    """
+    versions = get_cache_tag_versions(depends_on)
+    return '.'.join(versions[t] for t in sorted(versions))
+
+
+def invalidate_cache_tags(*objs):
+    """
+    使依赖这些标签的缓存失效,模型实例同时使其模型标签失效
+    :param objs: 标签,模型类或模型实例
+    :return:
+    """
+    tags = set()
+    for obj in objs:
+        tags.add(make_cache_tag(obj))
+        if not isinstance(obj, (str, type)):
+            tags.add(make_cache_tag(type(obj)))
+    if not tags:
+        return
+    logger.info('invalidate cache tags:%s' % ','.join(sorted(tags)))
+    cache.set_many({CACHE_TAG_VERSION_PREFIX + t: uuid.uuid4().hex[:8]
+                    for t in tags}, None)
+
+
+def get_fragment_cache_version(fragment_name, *objs):
+    """
+    获得模板片段缓存的依赖版本
+    :param fragment_name: 片段名称,见CACHE_FRAGMENT_DEPENDS_ON
+    :param objs: 额外依赖的模型实例
+    :return:
+    """
+    depends_on = CACHE_FRAGMENT_DEPENDS_ON.get(fragment_name, ()) + objs
+    return get_cache_tags_version(depends_on)
+
+
+# 页面公共部分(导航,侧边栏,面包屑,作者等)依赖的模型,文章卡片和正文中的相册图片依赖photologue
+CACHE_PAGE_DEPENDS_ON = tuple(sorted(set(
+    d for depends_on in CACHE_FRAGMENT_DEPENDS_ON.values() for d in depends_on) |
+    {'accounts.bloguser', 'photologue.gallery', 'photologue.photo'}))
+
+
+def get_page_etag(depends_on, *parts):
+    """
+    不渲染页面,根据依赖的缓存版本计算ETag
+    :param depends_on: 页面依赖的模型或模型实例
+    :param parts: 其他影响页面内容的值,如修改时间,用户id
+    :return: 弱ETag
+    """
+    value = ':'.join([get_cache_tags_version(depends_on)] + [str(p) for p in parts])
+    return 'W/"{etag}"'.format(etag=get_sha256(value)[:32])
+
+
+def patch_cache_control_policy(request, response, policy):
+    """
+    按settings.CACHE_CONTROL_MAX_AGE中的策略设置Cache-Control
+    登录用户的页面只允许浏览器缓存,并且每次都要重新验证
+    :param policy: 策略名称,如article,list,feed
+    :return: response
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return response
+    from django.conf import settings
+    from django.utils.cache import patch_cache_control
+    max_age = settings.CACHE_CONTROL_MAX_AGE
+    if isinstance(max_age, dict):
+        max_age = max_age.get(policy, max_age.get('default', 0))
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def _resolve_depends_on(depends_on, args, kwargs):
+    resolved = []
+    for d in depends_on:
+        if callable(d) and not isinstance(d, type):
+            resolved.extend(d(*args, **kwargs))
+        else:
+            resolved.append(d)
+    return resolved
+
+
+def _cache_key_arg(arg):
+    if isinstance(arg, Model):
+        return make_cache_tag(arg)
+    return repr(arg)
+
+
+def make_cache_key(func, args, kwargs):
+    """
+    生成稳定的缓存key,不包含对象的__str__和函数的内存地址,可以在多个进程间共享
+    模型方法: app.model:pk:方法名:参数摘要,其余函数: 模块:函数名:参数摘要
+    :param func: 被缓存的函数
+    :param args: 位置参数
+    :param kwargs: 关键字参数
+    :return:
+    """
+    if args and isinstance(args[0], Model) and args[0].pk is not None:
+        prefix = make_cache_tag(args[0])
+        name = func.__name__
+        args = args[1:]
+    else:
+        prefix = func.__module__
+        name = func.__qualname__
+    params = [_cache_key_arg(a) for a in args]
+    params.extend('{k}={v}'.format(k=k, v=_cache_key_arg(v))
+                  for k, v in sorted(kwargs.items()))
+    return '{prefix}:{name}:{digest}'.format(
+        prefix=prefix, name=name, digest=get_sha256(','.join(params))[:16])
+
+
+# 软过期缓存条目,fresh_until之后的值视为旧值
+_CacheEntry = namedtuple('_CacheEntry', ['value', 'fresh_until'])
+
+
+def _unpack_cache_entry(entry):
+    fresh_until = None
+    if isinstance(entry, _CacheEntry):
+        entry, fresh_until = entry.value, entry.fresh_until
+    if str(entry) == '__default_cache_value__':
+        entry = None
+    return entry, fresh_until
+
+
+def _wait_for_cache(key, lock_timeout):
+    """
+    等待其他调用者写入缓存
+    :return: 超时返回None
+    """
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def get_or_compute(key, compute, expiration, stale_key=None, lock_timeout=10,
+                   stale_expiration=60 * 60 * 24):
+    """
+    读取缓存,缓存中没有时只有拿到锁的调用者重新计算,其余调用者返回旧值或等待结果
+    :param key: 缓存key
+    :param compute: 没有参数的函数,返回值不能为None
+    :param expiration: 过期时间
+    :param stale_key: 保存旧值的key,不包含版本号,依赖失效后其余调用者返回旧值
+    :param lock_timeout: 重新计算锁的过期时间,也是最长等待时间
+    :param stale_expiration: 旧值的保存时间
+    :return:
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+    # 与其他使用key + ':lock'的更新锁区分
+    lock_key = key + ':compute'
+    locked = cache.add(lock_key, 1, lock_timeout)
+    if not locked:
+        value = cache.get(stale_key) if stale_key else None
+        if value is None:
+            value = _wait_for_cache(key, lock_timeout)
+        if value is not None:
+            return value
+    try:
+        logger.info('get_or_compute set cache key:%s' % key)
+        value = compute()
+        cache.set(key, value, expiration)
+        if stale_key:
+            cache.set(stale_key, value, stale_expiration)
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def cache_decorator(
+        expiration=3 * 60,
+        depends_on=None,
+        single_flight=False,
+        soft_expiration=None,
+        stale_if_error=False,
+        lock_timeout=10,
+        stale_expiration=60 * 60 * 24):
+    """
+    缓存函数结果
+    :param expiration: 过期时间
+    :param depends_on: 依赖的标签,模型类,或接收函数参数返回依赖的callable.依赖失效后缓存失效,
+                       模型方法自动依赖实例本身
+    :param single_flight: 缓存失效时只有一个调用者重新计算,其余调用者返回旧值或等待结果
+    :param soft_expiration: 软过期时间,超过后返回旧值,同时由一个调用者刷新缓存
+    :param stale_if_error: 重新计算出错时返回最近一次成功的结果
+    :param lock_timeout: 重新计算锁的过期时间
+    :param stale_expiration: 旧值的保存时间
+    :return:
+    """
+    keep_stale = single_flight or stale_if_error or soft_expiration
+
     def wrapper(func):
+        def set_value(key, stale_key, value):
+            value = '__default_cache_value__' if value is None else value
+            if soft_expiration:
+                cache.set(key, _CacheEntry(
+                    value, time.time() + soft_expiration), expiration)
+            else:
+                cache.set(key, value, expiration)
+            if keep_stale:
+                cache.set(stale_key, value, stale_expiration)
+
+        def compute(key, stale_key, args, kwargs):
+            logger.info(
+                'cache_decorator set cache:%s key:%s' %
+                (func.__name__, key))
+            try:
+                value = func(*args, **kwargs)
+            except Exception:
+                stale = cache.get(stale_key) if stale_if_error else None
+                if stale is None:
+                    raise
+                logger.exception(
+                    'cache_decorator return stale value:%s key:%s' %
+                    (func.__name__, key))
+                return _unpack_cache_entry(stale)[0]
+            set_value(key, stale_key, value)
+            return value
+
+        def compute_locked(key, stale_key, args, kwargs):
+            lock_key = key + ':lock'
+            if not cache.add(lock_key, 1, lock_timeout):
+                return False, None
+            try:
+                return True, compute(key, stale_key, args, kwargs)
+            finally:
+                cache.delete(lock_key)
+
+        @wraps(func)
         def news(*args, **kwargs):
             try:
                 view = args[0]
@@ -41,33 +345,83 @@ def cache_decorator(expiration=3 * 60):
             except BaseException:
                 key = None
             if not key:
-                unique_str = repr((func, args, kwargs))
-
-                m = sha256(unique_str.encode('utf-8'))
-                key = m.hexdigest()
-            value = cache.get(key)
-            if value is not None:
+                key = make_cache_key(func, args, kwargs)
+            stale_key = key + ':stale'
+            depends = _resolve_depends_on(depends_on or (), args, kwargs)
+            if args and isinstance(args[0], Model) and args[0].pk is not None:
+                # 模型方法依赖实例本身,实例写入后版本改变
+                depends.append(args[0])
+            if depends:
+                key = '{key}:{version}'.format(
+                    key=key, version=get_cache_tags_version(depends))
+            entry = cache.get(key)
+            if entry is not None:
                 # logger.info('cache_decorator get cache:%s key:%s' % (func.__name__, key))
-                if str(value) == '__default_cache_value__':
-                    return None
-                else:
+                value, fresh_until = _unpack_cache_entry(entry)
+                if fresh_until is None or fresh_until > time.time():
                     return value
-            else:
-                logger.info(
-                    'cache_decorator set cache:%s key:%s' %
-                    (func.__name__, key))
-                value = func(*args, **kwargs)
-                if value is None:
-                    cache.set(key, '__default_cache_value__', expiration)
-                else:
-                    cache.set(key, value, expiration)
-                return value
+                # 软过期,拿到锁的调用者刷新,其余调用者返回旧值
+                refreshed, new_value = compute_locked(
+                    key, stale_key, args, kwargs)
+                return new_value if refreshed else value
+            if single_flight:
+                computed, value = compute_locked(key, stale_key, args, kwargs)
+                if computed:
+                    return value
+                stale = cache.get(stale_key)
+                if stale is not None:
+                    return _unpack_cache_entry(stale)[0]
+                entry = _wait_for_cache(key, lock_timeout)
+                if entry is not None:
+                    return _unpack_cache_entry(entry)[0]
+            return compute(key, stale_key, args, kwargs)
 
         return news
 
     return wrapper
 
 
+# 请求内的memo,由blog.middleware.RequestMemoMiddleware在请求开始时创建,请求结束后丢弃
+_request_memo = threading.local()
+
+
+def begin_request_memo():
+    _request_memo.values = {}
+
+
+def end_request_memo():
+    _request_memo.values = None
+
+
+def request_memoize(func):
+    """
+    在一个请求内缓存函数结果,同一次渲染中参数相同的调用只计算一次,不在请求中时直接调用.
+    节省的重新计算次数记录为缓存统计中request_memo.函数名的命中数
+    :param func: 被缓存的函数,参数需要可以hash
+    :return:
+    """
+    namespace = 'request_memo.{name}'.format(name=func.__name__)
+
+    @wraps(func)
+    def news(*args, **kwargs):
+        values = getattr(_request_memo, 'values', None)
+        if values is None:
+            return func(*args, **kwargs)
+        key = (func, args, tuple(sorted(kwargs.items())))
+        try:
+            if key in values:
+                cache_stats.record(namespace, 'hits')
+                return values[key]
+        except TypeError:
+            # 参数不能hash
+            return func(*args, **kwargs)
+        cache_stats.record(namespace, 'misses')
+        value = values[key] = func(*args, **kwargs)
+        return value
+
+    return news
+
+
 def expire_view_cache(path, servername, serverport, key_prefix=None):
     '''
     刷新视图缓存
@@ -93,9 +447,34 @@ def expire_view_cache(path, servername, serverport, key_prefix=None):
     return False
 
 
+# markdown渲染规则改变后加1,然后执行./manage.py render_content重新渲染已保存的html
+MARKDOWN_RENDERER_VERSION = 1
+
+# markdown和代码高亮结果的缓存时间
+MARKDOWN_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+@lru_cache(maxsize=256)
+def get_lexer(lang):
+    """
+    获得代码高亮的lexer,每个进程按语言复用
+    :param lang: 语言
+    :return: 不支持的语言返回None
+    """
+    try:
+        return get_lexer_by_name(lang, stripall=True)
+    except ClassNotFound:
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_html_formatter(inlinestyles, linenos):
+    return html.HtmlFormatter(noclasses=inlinestyles, linenos=linenos)
+
+
 def block_code(text, lang, inlinestyles=False, linenos=False):
     '''
-    markdown代码高亮
+    markdown代码高亮,结果按代码,语言,选项和渲染器版本的摘要缓存,相同的代码只高亮一次
     :param text:
     :param lang:
     :param inlinestyles:
@@ -106,31 +485,68 @@ def block_code(text, lang, inlinestyles=False, linenos=False):
         text = text.strip()
         return u'<pre><code>%s</code></pre>\n' % mistune.escape(text)
 
+    key = 'highlight:{digest}'.format(digest=get_sha256('\0'.join(
+        (str(MARKDOWN_RENDERER_VERSION), lang, str(inlinestyles), str(linenos), text))))
+    code = cache.get(key)
+    if code is not None:
+        return code
     try:
-        lexer = get_lexer_by_name(lang, stripall=True)
-        formatter = html.HtmlFormatter(
-            noclasses=inlinestyles, linenos=linenos
-        )
-        code = highlight(text, lexer, formatter)
+        lexer = get_lexer(lang)
+        if lexer is None:
+            raise ClassNotFound(lang)
+        code = highlight(text, lexer, get_html_formatter(inlinestyles, linenos))
         if linenos:
-            return '<div class="highlight">%s</div>\n' % code
-        return code
+            code = '<div class="highlight">%s</div>\n' % code
     except BaseException:
-        return '<pre class="%s"><code>%s</code></pre>\n' % (
+        code = '<pre class="%s"><code>%s</code></pre>\n' % (
             lang, mistune.escape(text)
         )
+    cache.set(key, code, MARKDOWN_CACHE_TIMEOUT)
+    return code
+
+
+# 其他worker修改站点后,本进程最多隔多少秒发现
+SITE_VERSION_CHECK_INTERVAL = 5
+# 进程内的当前站点: (站点, sites.site的缓存版本, 上次检查版本的时间)
+_current_site = None
 
 
-@cache_decorator()
 def get_current_site():
-    site = Site.objects.get_current()
+    """
+    获得当前站点,保存在进程内,不需要访问缓存.
+    本进程修改站点后立即失效(见DjangoBlog.blog_signals),其他worker修改后通过sites.site的缓存版本发现
+    :return: Site
+    """
+    global _current_site
+    entry = _current_site
+    now = time.monotonic()
+    if entry is not None and now - entry[2] < SITE_VERSION_CHECK_INTERVAL:
+        return entry[0]
+    version = get_cache_tags_version(('sites.site',))
+    if entry is not None and entry[1] == version:
+        site = entry[0]
+    else:
+        # Site.objects也有进程内缓存,不会随其他worker的修改失效
+        Site.objects.clear_cache()
+        site = Site.objects.get_current()
+    _current_site = (site, version, now)
     return site
 
 
+def clear_current_site():
+    global _current_site
+    _current_site = None
+
+
 class BlogMarkDownRenderer(mistune.Renderer):
     '''
     markdown渲染
     '''
+    # 本次渲染的站点域名,由CommonMarkdown.get_markdown设置,每个链接不需要再获取站点
+    site_domain = None
+
+    def get_site_domain(self):
+        return self.site_domain or get_current_site().domain
 
     def block_code(self, text, lang=None):
         # renderer has an options
@@ -145,14 +561,12 @@ class BlogMarkDownRenderer(mistune.Renderer):
             link = 'mailto:%s' % link
         if not link:
             link = "#"
-        site = get_current_site()
-        nofollow = "" if link.find(site.domain) > 0 else "rel='nofollow'"
+        nofollow = "" if link.find(self.get_site_domain()) > 0 else "rel='nofollow'"
         return '<a href="%s" %s>%s</a>' % (link, nofollow, text)
 
     def link(self, link, title, text):
         link = escape_link(link)
-        site = get_current_site()
-        nofollow = "" if link.find(site.domain) > 0 else "rel='nofollow'"
+        nofollow = "" if link.find(self.get_site_domain()) > 0 else "rel='nofollow'"
         if not link:
             link = "#"
         if not title:
@@ -163,12 +577,49 @@ class BlogMarkDownRenderer(mistune.Renderer):
 
 
 class CommonMarkdown():
+    _local = threading.local()
+
     @staticmethod
     def get_markdown(value):
-        renderer = BlogMarkDownRenderer(inlinestyles=False)
+        """
+        渲染markdown,结果按内容,站点域名(决定链接是否nofollow)和渲染器版本的摘要缓存
+        :param value: markdown
+        :return: html
+        """
+        domain = get_current_site().domain
+        key = 'markdown:{digest}'.format(digest=get_sha256('\0'.join(
+            (str(MARKDOWN_RENDERER_VERSION), domain, value))))
+        content = cache.get(key)
+        if content is None:
+            parser = CommonMarkdown._get_parser()
+            parser.renderer.site_domain = domain
+            content = parser(value)
+            cache.set(key, content, MARKDOWN_CACHE_TIMEOUT)
+        return content
 
-        mdp = mistune.Markdown(escape=True, renderer=renderer)
-        return mdp(value)
+    @staticmethod
+    def _get_parser():
+        # mistune.Markdown每次解析前重置状态,每个线程复用一个
+        parser = getattr(CommonMarkdown._local, 'parser', None)
+        if parser is None:
+            renderer = BlogMarkDownRenderer(inlinestyles=False)
+            parser = CommonMarkdown._local.parser = mistune.Markdown(
+                escape=True, renderer=renderer)
+        return parser
+
+
+def render_markdown_content(body, excerpt_length):
+    """
+    渲染markdown正文,保存时调用,见blog.models.RenderedContentModel
+    :param body: markdown正文
+    :param excerpt_length: 摘要长度
+    :return: (正文html, 摘要html, 纯文本)
+    """
+    from django.template.defaultfilters import truncatechars_html
+    body_html = CommonMarkdown.get_markdown(body or '')
+    excerpt_html = truncatechars_html(body_html, excerpt_length)
+    plain_text = unescape(strip_tags(body_html)).strip()
+    return body_html, excerpt_html, plain_text
 
 
 def send_email(emailto, title, content):
@@ -192,8 +643,11 @@ def parse_dict_to_url(dict):
     return url
 
 
+@request_memoize
 def get_blog_setting():
-    value = cache.get('get_blog_setting')
+    key = 'get_blog_setting:{version}'.format(
+        version=get_cache_tags_version(('blog.blogsettings',)))
+    value = cache.get(key)
     if value:
         return value
     else:
@@ -210,7 +664,7 @@ def get_blog_setting():
             setting.save()
         value = BlogSettings.objects.first()
         logger.info('set cache get_blog_setting')
-        cache.set('get_blog_setting', value)
+        cache.set(key, value)
         return value
 
 
@@ -252,18 +706,6 @@ def save_user_avatar(url):
         return url
 
 
-def delete_sidebar_cache(username):
-    from django.core.cache.utils import make_template_fragment_key
-    from blog.models import LinkShowType
-    keys = (
-        make_template_fragment_key(
-            'sidebar', [
-                username + x]) for x in LinkShowType.values)
-    for k in keys:
-        logger.info('delete sidebar key:' + k)
-        cache.delete(k)
-
-
 def delete_view_cache(prefix, keys):
     from django.core.cache.utils import make_template_fragment_key
     key = make_template_fragment_key(prefix, keys)
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DjangoBlog.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.WARM_CACHE_ON_BOOT:
+    from blog.cache_warmup import warm_cache_on_boot
+
+    warm_cache_on_boot()
@@ -83,7 +83,6 @@ class AccountTest(TestCase):
         user.is_superuser = True
         user.is_staff = True
         user.save()
-        delete_sidebar_cache(user.username)
         category = Category()
         category.name = "categoryaaa"
         category.created_time = timezone.now()
@@ -84,8 +84,6 @@ class LogoutView(RedirectView):
         return super(LogoutView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        from DjangoBlog.utils import cache
-        cache.clear()
         logout(request)
         return super(LogoutView, self).get(request, *args, **kwargs)
 
@@ -116,9 +114,6 @@ class LoginView(FormView):
         form = AuthenticationForm(data=self.request.POST, request=self.request)
 
         if form.is_valid():
-            from DjangoBlog.utils import cache
-            if cache and cache is not None:
-                cache.clear()
             logger.info(self.redirect_field_name)
 
             auth.login(self.request, form.get_user())
@@ -1,11 +1,14 @@
 from django.contrib import admin
 # Register your models here.
-from .models import Article, Category, Tag, Links, SideBar, BlogSettings
+from .models import Article, Category, Tag, Links, SideBar, BlogSettings, refresh_article_counts
 from django import forms
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.timezone import now
+from DjangoBlog.utils import invalidate_cache_tags
+from blog.archives import update_archive_index
 
 
 class ArticleListFilter(admin.SimpleListFilter):
@@ -32,14 +35,30 @@ class ArticleForm(forms.ModelForm):
         fields = '__all__'
 
 
-def makr_article_publish(modeladmin, request, queryset):
-    queryset.update(status='p')
+def update_article_status(queryset, status):
+    """
+    修改文章状态.先取出选中的文章,按状态过滤时update之后queryset已经不包含这些文章
+    :param queryset: 选中的文章
+    :param status: 新的状态
+    """
+    ids = list(queryset.values_list('id', flat=True))
+    Article.objects.filter(id__in=ids).update(status=status, last_mod_time=now())
+    articles = list(Article.objects.filter(id__in=ids))
+    # update()不会触发post_save,手动使缓存失效,更新文章数和归档索引
+    invalidate_cache_tags(Article, *articles)
+    refresh_article_counts(
+        Article.tags.through.objects.filter(
+            article_id__in=ids).values_list('tag_id', flat=True),
+        [article.category_id for article in articles])
+    update_archive_index(articles)
 
 
-def draft_article(modeladmin, request, queryset):
-    queryset.update(status='d')
+def makr_article_publish(modeladmin, request, queryset):
+    update_article_status(queryset, 'p')
 
 
+def draft_article(modeladmin, request, queryset):
+    update_article_status(queryset, 'd')
 
 
 makr_article_publish.short_description = '發布選中文章'
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = 'blog'
+
+    def ready(self):
+        # 注册信号,不依赖urls被加载,文章数等在管理命令中也能更新
+        import DjangoBlog.blog_signals
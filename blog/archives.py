@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: archives.py
+@time: 2026/10/18
+
+文章归档索引.
+缓存中保存 {年: {月: ((id, 标题, 发表时间, url), ...)}},按发表时间倒序,只包含已发表的文章,
+第一次使用时用一次values_list查询生成,之后文章保存,删除,发表或设为草稿时在事务提交后只更新对应的文章(见DjangoBlog.blog_signals),
+多个worker同时更新时可能丢失修改,索引最多保存ARCHIVE_INDEX_TIMEOUT秒,之后重新生成.
+归档页,按年和按月的归档分页和侧边栏的月份列表都从索引读取,不需要查询数据库.
+文章详情页的上一篇和下一篇使用由归档索引生成的按id排序的相邻文章索引,二分查找.
+"""
+import datetime
+import logging
+from array import array
+from bisect import bisect_left
+
+from django.db import transaction
+
+from blog.models import Article
+from blog.records import ArticleLinkRecord
+from DjangoBlog.utils import cache, get_or_compute
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_INDEX_KEY = 'archive_index'
+NEIGHBOR_INDEX_KEY = 'article_neighbor_index'
+LOCK_TIMEOUT = 10
+# 归档索引和相邻文章索引的保存时间,增量更新出现偏差时最多保留这么久
+ARCHIVE_INDEX_TIMEOUT = 60 * 60
+# 影响归档索引的字段
+ARCHIVE_FIELDS = ('title', 'status', 'pub_time', 'created_time')
+
+
+def make_row(id, title, pub_time, created_time):
+    # url由创建时间和id生成,见Article.get_absolute_url
+    url = Article(id=id, created_time=created_time).get_absolute_url()
+    return (id, title, pub_time, url)
+
+
+def build_archive_index():
+    """
+    查询数据库生成归档索引
+    :return:
+    """
+    index = {}
+    rows = Article.objects.filter(status='p').order_by('-pub_time', '-id').values_list(
+        'id', 'title', 'pub_time', 'created_time')
+    for id, title, pub_time, created_time in rows:
+        index.setdefault(pub_time.year, {}).setdefault(pub_time.month, []).append(
+            make_row(id, title, pub_time, created_time))
+    return {year: {month: tuple(rows) for month, rows in months.items()}
+            for year, months in index.items()}
+
+
+def get_archive_index():
+    """
+    获得归档索引
+    :return: {年: {月: ((id, 标题, 发表时间, url), ...)}}
+    """
+    return get_or_compute(ARCHIVE_INDEX_KEY, build_archive_index, ARCHIVE_INDEX_TIMEOUT)
+
+
+def update_archive_index(articles, deleted=False):
+    """
+    文章修改后更新归档索引,已发表的文章放入发表时间对应的月份,其余的移除.
+    在事务提交之后执行,索引中不会出现没有提交的修改
+    :param articles: 修改的文章
+    :param deleted: 文章已删除
+    """
+    rows = [(article.id, article.title, article.status, article.pub_time, article.created_time)
+            for article in articles]
+    transaction.on_commit(lambda: _update_archive_index(rows, deleted))
+
+
+def _update_archive_index(articles, deleted):
+    lock_key = ARCHIVE_INDEX_KEY + ':lock'
+    dirty_key = ARCHIVE_INDEX_KEY + ':dirty'
+    # 多个worker同时更新时加锁,拿不到锁时删除索引,下次使用时重新生成.
+    # 拿到锁的worker可能随后写回不包含这次修改的索引,所以同时标记,由它在写回之后再删除
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        cache.set(dirty_key, 1, LOCK_TIMEOUT)
+        cache.delete_many([ARCHIVE_INDEX_KEY, NEIGHBOR_INDEX_KEY])
+        return
+    try:
+        index = cache.get(ARCHIVE_INDEX_KEY)
+        if index is None:
+            return
+        ids = set(id for id, title, status, pub_time, created_time in articles)
+        index = {year: {month: tuple(row for row in rows if row[0] not in ids)
+                        for month, rows in months.items()}
+                 for year, months in index.items()}
+        for id, title, status, pub_time, created_time in articles:
+            if deleted or status != 'p':
+                continue
+            months = index.setdefault(pub_time.year, {})
+            rows = months.get(pub_time.month, ()) + (
+                make_row(id, title, pub_time, created_time),)
+            months[pub_time.month] = tuple(
+                sorted(rows, key=lambda row: (row[2], row[0]), reverse=True))
+        # 去掉没有文章的月份和年份
+        index = {year: {month: rows for month, rows in months.items() if rows}
+                 for year, months in index.items()}
+        cache.set(ARCHIVE_INDEX_KEY, {
+            year: months for year, months in index.items() if months}, ARCHIVE_INDEX_TIMEOUT)
+        if cache.get(dirty_key):
+            cache.delete_many([ARCHIVE_INDEX_KEY, dirty_key])
+    finally:
+        # 相邻文章索引下次使用时由归档索引重新生成
+        cache.delete_many([NEIGHBOR_INDEX_KEY, lock_key])
+
+
+def get_archive_months():
+    """
+    有文章的月份和文章数
+    :return: [(年, [(月, 文章数)])],倒序
+    """
+    index = get_archive_index()
+    return [(year, [(month, len(index[year][month]))
+                    for month in sorted(index[year], reverse=True)])
+            for year in sorted(index, reverse=True)]
+
+
+def get_archive_dates():
+    """
+    侧边栏的月份列表
+    :return: (datetime, ...),倒序
+    """
+    return tuple(datetime.datetime(year, month, 1)
+                 for year, months in get_archive_months() for month, _ in months)
+
+
+def get_archive_articles(year=None, month=None):
+    """
+    某年或某月的文章
+    :return: RecordList,倒序
+    """
+    index = get_archive_index()
+    months = index.get(year, {})
+    if month is not None:
+        rows = months.get(month, ())
+    else:
+        rows = [row for m in sorted(months, reverse=True) for row in months[m]]
+    return ArticleLinkRecord.load_many(rows)
+
+
+def get_neighbor_index():
+    """
+    获得相邻文章索引,由归档索引生成,不查询数据库
+    :return: (按id排序的文章id数组, 对应的(id, 标题, 发表时间, url))
+    """
+    value = cache.get(NEIGHBOR_INDEX_KEY)
+    if value is None:
+        rows = sorted((row for months in get_archive_index().values()
+                       for rows in months.values() for row in rows), key=lambda row: row[0])
+        value = (array('l', (row[0] for row in rows)), tuple(rows))
+        cache.set(NEIGHBOR_INDEX_KEY, value, ARCHIVE_INDEX_TIMEOUT)
+        logger.info('set article neighbor index cache')
+    return value
+
+
+def get_article_neighbors(article_id):
+    """
+    获得id相邻的已发表文章
+    :param article_id: 文章id,文章不需要已发表
+    :return: (上一篇, 下一篇),ArticleLinkRecord或None
+    """
+    ids, rows = get_neighbor_index()
+    position = bisect_left(ids, article_id)
+    prev_article = ArticleLinkRecord(rows[position - 1]) if position > 0 else None
+    if position < len(ids) and ids[position] == article_id:
+        position += 1
+    next_article = ArticleLinkRecord(rows[position]) if position < len(ids) else None
+    return prev_article, next_article
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: cache_warmup.py
+@time: 2026/10/18
+
+缓存预热.通过完整的中间件和视图渲染首页,文章,分类,标签,作者,归档等页面,
+让部署或清空缓存之后的第一批访客不需要重建缓存.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.base import BaseHandler
+from django.db import close_old_connections, connections
+from django.test import RequestFactory
+from django.urls import reverse
+
+from DjangoBlog.utils import cache, get_blog_setting, get_current_site
+from blog.archives import get_archive_months
+from blog.models import Article, Category, Tag, Page
+from blog.popularity import get_popular_articles
+
+logger = logging.getLogger(__name__)
+
+# 优先级,数字越小越先预热
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# 预热请求在environ中的标记,不以HTTP_开头,客户端无法通过请求头伪造
+WARMUP_ENVIRON_KEY = 'blog.cache_warmup'
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def is_warmup_request(request):
+    """
+    是否是缓存预热发出的请求
+    :param request: 请求
+    :return:
+    """
+    return bool(request.META.get(WARMUP_ENVIRON_KEY))
+
+
+def get_handler():
+    """
+    获得加载了全部中间件的handler,与线上请求经过同样的中间件,不触发request_started等信号
+    """
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            handler = BaseHandler()
+            handler.load_middleware()
+            _handler = handler
+    return _handler
+
+
+def get_warmup_urls(index_pages=3, article_count=None):
+    """
+    获得需要预热的url
+    :param index_pages: 预热的首页页数
+    :param article_count: 预热的热门文章数,默认为侧边栏显示的文章数
+    :return: [(priority, url)],按优先级排序
+    """
+    if article_count is None:
+        article_count = get_blog_setting().sidebar_article_count
+    published = Article.objects.filter(type='a', status='p')
+    urls = [(PRIORITY_HIGH, reverse('blog:index'))]
+    total_pages = (published.count() + settings.PAGINATE_BY -
+                   1) // settings.PAGINATE_BY
+    for page in range(2, min(index_pages, total_pages) + 1):
+        urls.append((PRIORITY_HIGH, reverse(
+            'blog:index_page', kwargs={'page': page})))
+    # 与侧边栏的热门文章一致
+    for article in get_popular_articles(article_count) or published[:article_count]:
+        urls.append((PRIORITY_HIGH, article.get_absolute_url()))
+    urls.append((PRIORITY_NORMAL, reverse('blog:archives')))
+    for year, months in get_archive_months():
+        urls.append((PRIORITY_LOW, reverse(
+            'blog:archives_year', kwargs={'year': year})))
+    for category in Category.objects.all():
+        urls.append((PRIORITY_NORMAL, category.get_absolute_url()))
+    for tag in Tag.objects.all():
+        urls.append((PRIORITY_LOW, tag.get_absolute_url()))
+    authors = published.order_by().values_list(
+        'author__username', flat=True).distinct()
+    for username in authors:
+        urls.append((PRIORITY_LOW, reverse(
+            'blog:author_detail', kwargs={'author_name': username})))
+    for page in Page.objects.all():
+        urls.append((PRIORITY_LOW, page.get_absolute_url()))
+    return sorted(urls, key=lambda item: item[0])
+
+
+def _pickled_size(value):
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+@contextmanager
+def track_cache_fill():
+    """
+    统计当前线程写入默认缓存的数据大小(pickle之后的字节数)
+    """
+    instance = caches['default']
+    stats = {'size': 0}
+    sizeof = {
+        'set': lambda key, value, *args, **kwargs: _pickled_size(value),
+        'add': lambda key, value, *args, **kwargs: _pickled_size(value),
+        'set_many': lambda data, *args, **kwargs: sum(
+            _pickled_size(value) for value in data.values()),
+    }
+
+    def wrap(name):
+        method = getattr(instance, name)
+
+        def wrapper(*args, **kwargs):
+            stats['size'] += sizeof[name](*args, **kwargs)
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    for name in sizeof:
+        setattr(instance, name, wrap(name))
+    try:
+        yield stats
+    finally:
+        for name in sizeof:
+            instance.__dict__.pop(name, None)
+
+
+def warm_url(url):
+    """
+    以匿名用户身份请求url,填充缓存
+    :param url: 站内路径
+    :return: (url, 状态码, 耗时秒数, 写入缓存的字节数)
+    """
+    close_old_connections()
+    request = RequestFactory(HTTP_HOST=get_current_site().domain).get(url)
+    request.META[WARMUP_ENVIRON_KEY] = True
+    start = time.time()
+    with track_cache_fill() as stats:
+        response = get_handler().get_response(request)
+    cost = time.time() - start
+    if response.status_code != 200:
+        logger.warning('warm cache url:%s status:%d' %
+                       (url, response.status_code))
+    return url, response.status_code, cost, stats['size']
+
+
+def _warm_url_in_thread(url):
+    try:
+        return warm_url(url)
+    finally:
+        connections.close_all()
+
+
+def warm_cache(urls, concurrency=4):
+    """
+    按优先级预热url
+    :param urls: [(priority, url)]
+    :param concurrency: 同时渲染的url数,小于等于1时在当前线程中依次渲染
+    :return: [(url, 状态码, 耗时秒数, 写入缓存的字节数)]
+    """
+    urls = [url for priority, url in sorted(urls, key=lambda item: item[0])]
+    if concurrency <= 1:
+        return [warm_url(url) for url in urls]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_warm_url_in_thread, urls))
+
+
+def warm_cache_on_boot():
+    """
+    worker启动时在后台线程中预热,同一台机器上同时启动的worker只有一个会执行
+    """
+    if not cache.add('warm_cache_on_boot', os.getpid(), 60 * 10):
+        return
+
+    def run():
+        try:
+            results = warm_cache(
+                get_warmup_urls(),
+                concurrency=settings.WARM_CACHE_CONCURRENCY)
+            logger.info('warm cache on boot, %d urls, %.2fs' % (
+                len(results), sum(result[2] for result in results)))
+        except Exception as e:
+            logger.error(e)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, name='warm_cache', daemon=True).start()
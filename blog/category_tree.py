@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: category_tree.py
+@time: 2026/10/18
+
+进程内的分类目录树.
+一次查询读取所有分类,预先计算每个分类到根分类的路径和包括自身的所有子分类id,
+保存在进程内存中,blog.category的缓存版本改变(任一分类保存或删除)后重新读取.
+面包屑,分类列表页和导航按id从树中获取,不需要逐级查询.
+"""
+import logging
+import threading
+
+from blog.models import Category
+from blog.records import CategoryRecord
+from DjangoBlog.utils import get_cache_tags_version
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_tree = None
+
+
+class CategoryTree(object):
+    """
+    分类目录树,分类为CategoryRecord,顺序与Category.Meta.ordering一致
+    """
+
+    def __init__(self, categorys, version=None):
+        self.version = version
+        self.categorys = tuple(categorys)
+        self.by_id = {c.id: c for c in self.categorys}
+        self.by_slug = {}
+        children = {}
+        for c in self.categorys:
+            self.by_slug.setdefault(c.slug, c)
+            children.setdefault(c.parent_category_id, []).append(c.id)
+        self.children = {id: tuple(ids) for id, ids in children.items()}
+        self.ancestors = {c.id: self._get_path(c) for c in self.categorys}
+        self.descendants = {c.id: self._get_descendant_ids(c.id)
+                            for c in self.categorys}
+
+    def _get_path(self, category):
+        path = []
+        # 父分类出现循环时停止
+        while category is not None and category not in path:
+            path.append(category)
+            category = self.by_id.get(category.parent_category_id)
+        return tuple(path)
+
+    def _get_descendant_ids(self, id):
+        ids = [id]
+        seen = {id}
+        for current in ids:
+            for child in self.children.get(current, ()):
+                if child not in seen:
+                    seen.add(child)
+                    ids.append(child)
+        return tuple(ids)
+
+    def get(self, id):
+        return self.by_id.get(id)
+
+    def get_by_slug(self, slug):
+        return self.by_slug.get(slug)
+
+    def get_ancestors(self, id):
+        """
+        从当前分类到根分类的路径
+        :param id: 分类id
+        :return: (CategoryRecord, ...),第一个为当前分类
+        """
+        return self.ancestors.get(id, ())
+
+    def get_descendant_ids(self, id):
+        """
+        当前分类和所有子分类的id
+        :param id: 分类id
+        :return: (id, ...),第一个为当前分类
+        """
+        return self.descendants.get(id, ())
+
+    def get_descendants(self, id):
+        return tuple(self.by_id[i] for i in self.get_descendant_ids(id))
+
+
+def get_category_tree():
+    """
+    获得分类目录树,分类修改后重新读取
+    :return: CategoryTree
+    """
+    global _tree
+    version = get_cache_tags_version(('blog.category',))
+    tree = _tree
+    if tree is not None and tree.version == version:
+        return tree
+    with _lock:
+        if _tree is None or _tree.version != version:
+            _tree = CategoryTree(CategoryRecord.load_many(
+                CategoryRecord.dump_many(Category.objects.all())), version)
+            logger.info('load category tree.version:{version}'.format(
+                version=version))
+        return _tree
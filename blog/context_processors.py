@@ -12,37 +12,76 @@
 @file: context_processors.py
 @time: 2016/11/6 下午4:23
 """
-from .models import Category, Article, Page, Tag, BlogSettings
-from DjangoBlog.utils import cache, get_blog_setting
+from django.utils.functional import SimpleLazyObject
+
+from .models import Article, Page
+from .category_tree import get_category_tree
+from .records import ArticleLinkRecord, CategoryRecord, PageNode, PageRecord
+from DjangoBlog.utils import get_blog_setting, get_cache_tags_version, get_or_compute, request_memoize
 
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 导航快照依赖的模型
+NAVIGATION_DEPENDS_ON = ('blog.blogsettings', 'blog.category', 'blog.page', 'blog.article')
+
+
+def build_navigation_snapshot():
+    """
+    查询数据库生成导航快照,只包含字段值组成的tuple
+    :return: dict
+    """
+    setting = get_blog_setting()
+    pages = list(Page.objects.all())
+    return {
+        'SITE_NAME': setting.sitename,
+        'SHOW_GOOGLE_ADSENSE': setting.show_google_adsense,
+        'GOOGLE_ADSENSE_CODES': setting.google_adsense_codes,
+        'SITE_SEO_DESCRIPTION': setting.site_seo_description,
+        'SITE_DESCRIPTION': setting.site_description,
+        'SITE_KEYWORDS': setting.site_keywords,
+        'ARTICLE_SUB_LENGTH': setting.article_sub_length,
+        'nav_category_list': CategoryRecord.dump_many(get_category_tree().categorys),
+        'info_pages': PageRecord.dump_many(pages),
+        'nav_page_tree': PageNode.dump_tree(pages),
+        # 只查询链接需要的字段,见blog.records.ArticleLinkRecord
+        'nav_pages': ArticleLinkRecord.dump_many(Article.objects.filter(
+            type='p',
+            status='p').only('id', 'title', 'pub_time', 'created_time')),
+    }
+
+
+@request_memoize
+def get_navigation_snapshot():
+    """
+    获得导航快照,依赖的模型写入后重新生成,同一个请求只读取一次缓存
+    :return: dict
+    """
+    key = 'seo_processor:{version}'.format(
+        version=get_cache_tags_version(NAVIGATION_DEPENDS_ON))
+    return get_or_compute(key, build_navigation_snapshot, 60 * 60 * 10,
+                          stale_key='seo_processor:stale')
+
 
 def seo_processor(requests):
-    key = 'seo_processor'
-    value = cache.get(key)
-    if value:
-        return value
-    else:
-        logger.info('set processor cache.')
-        setting = get_blog_setting()
-        value = {
-            'SITE_NAME': setting.sitename,
-            'SHOW_GOOGLE_ADSENSE': setting.show_google_adsense,
-            'GOOGLE_ADSENSE_CODES': setting.google_adsense_codes,
-            'SITE_SEO_DESCRIPTION': setting.site_seo_description,
-            'SITE_DESCRIPTION': setting.site_description,
-            'SITE_KEYWORDS': setting.site_keywords,
-            'SITE_BASE_URL': requests.scheme + '://' + requests.get_host() + '/',
-            'ARTICLE_SUB_LENGTH': setting.article_sub_length,
-            'nav_category_list': Category.objects.all(),
-            'info_pages': Page.objects.all(),
-            'nav_pages': Article.objects.filter(
-                type='p',
-                status='p'),
-            "CURRENT_YEAR": datetime.now().year}
-        cache.set(key, value, 60 * 60 * 10)
-        return value
+    # 所有值都是惰性的,模板没有使用时不读取缓存;缓存中只保存字段值,使用时重建只读记录,不查询数据库
+    def lazy(name, load=None):
+        def get():
+            value = get_navigation_snapshot()[name]
+            return load(value) if load else value
+
+        return SimpleLazyObject(get)
+
+    context = {name: lazy(name) for name in (
+        'SITE_NAME', 'SHOW_GOOGLE_ADSENSE', 'GOOGLE_ADSENSE_CODES', 'SITE_SEO_DESCRIPTION',
+        'SITE_DESCRIPTION', 'SITE_KEYWORDS', 'ARTICLE_SUB_LENGTH')}
+    context.update(
+        SITE_BASE_URL=requests.scheme + '://' + requests.get_host() + '/',
+        CURRENT_YEAR=datetime.now().year,
+        nav_category_list=lazy('nav_category_list', CategoryRecord.load_many),
+        info_pages=lazy('info_pages', PageRecord.load_many),
+        nav_page_tree=lazy('nav_page_tree', PageNode.load_tree),
+        nav_pages=lazy('nav_pages', ArticleLinkRecord.load_many))
+    return context
@@ -207,6 +207,7 @@ class ArticleDocumentManager():
                 pub_time=article.pub_time,
                 status=article.status,
                 type=article.type,
+                views=article.views,
                 article_order=article.article_order) for article in articles]
 
     def rebuild(self, articles=None):
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: cache_stats.py
+@time: 2026/10/18
+"""
+from django.core.management.base import BaseCommand
+
+from DjangoBlog.cache_stats import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'show cache hits, misses, sets, evictions, value sizes and compute time per key namespace'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='clear the collected stats')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Cleared cache stats'))
+            return
+        self.stdout.write('%-60s %10s %10s %7s %8s %9s %10s %12s' % (
+            'namespace', 'hits', 'misses', 'ratio', 'sets', 'evictions', 'avg bytes', 'avg compute'))
+        for item in get_stats():
+            self.stdout.write('%-60s %10d %10d %6.1f%% %8d %9d %10d %10.1fms' % (
+                item['namespace'][:60], item['hits'], item['misses'], item['hit_ratio'] * 100,
+                item['sets'], item['evictions'], item['avg_bytes'], item['avg_compute_ms']))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: reconcile_article_counts.py
+@time: 2026/10/18
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from blog.models import Article, Category, Tag
+from DjangoBlog.utils import invalidate_cache_tags
+
+
+class Command(BaseCommand):
+    help = 'rebuild the published article count of every tag and category'
+
+    def reconcile(self, model, counts):
+        changed = []
+        for obj in model.objects.only('id', 'article_count'):
+            count = counts.get(obj.id, 0)
+            if obj.article_count != count:
+                obj.article_count = count
+                changed.append(obj)
+        if changed:
+            model.objects.bulk_update(changed, ['article_count'], batch_size=500)
+            invalidate_cache_tags(model)
+        self.stdout.write('fix %d %s' % (len(changed), model._meta.verbose_name))
+
+    def handle(self, *args, **options):
+        tag_counts = dict(Article.tags.through.objects.filter(
+            article__status='p').order_by().values('tag').annotate(
+            count=Count('article')).values_list('tag', 'count'))
+        category_counts = dict(Article.objects.filter(
+            status='p').order_by().values('category').annotate(
+            count=Count('id')).values_list('category', 'count'))
+        self.reconcile(Tag, tag_counts)
+        self.reconcile(Category, category_counts)
+        self.stdout.write(self.style.SUCCESS('finish reconcile article counts'))
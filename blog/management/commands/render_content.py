@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: render_content.py
+@time: 2026/10/18
+"""
+from django.core.management.base import BaseCommand
+
+from blog.models import About, Article, Page, RenderedContentModel
+from DjangoBlog.utils import invalidate_cache_tags
+
+
+class Command(BaseCommand):
+    help = 're-render the saved html, excerpt and plain text of articles, pages and about'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            default=False,
+            help='render all rows, default only rows rendered by an old renderer version or excerpt length')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='how many rows are updated in one query')
+
+    def update(self, model, batch):
+        model.objects.bulk_update(batch, RenderedContentModel.RENDERED_FIELDS)
+        # bulk_update不发送信号,手动使缓存失效
+        invalidate_cache_tags(model, *batch)
+
+    def handle(self, *args, **options):
+        version = RenderedContentModel.get_render_version()
+        for model in (Article, Page, About):
+            queryset = model.objects.all()
+            if not options['all']:
+                queryset = queryset.exclude(render_version=version)
+            count = 0
+            batch = []
+            for obj in queryset.iterator():
+                obj.render_content()
+                batch.append(obj)
+                if len(batch) >= options['batch_size']:
+                    self.update(model, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.update(model, batch)
+                count += len(batch)
+            self.stdout.write('render %d %s' %
+                              (count, model._meta.verbose_name))
+        self.stdout.write(self.style.SUCCESS(
+            'finish render, version:%s' % version))
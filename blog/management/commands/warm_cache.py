@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: warm_cache.py
+@time: 2026/10/18
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.cache_warmup import get_warmup_urls, warm_cache
+
+
+class Command(BaseCommand):
+    help = 'render index, article, category, tag, author and archives pages to fill the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.WARM_CACHE_CONCURRENCY,
+            help='how many urls are rendered at the same time')
+        parser.add_argument(
+            '--index-pages',
+            type=int,
+            default=3,
+            help='how many index pages to render')
+        parser.add_argument(
+            '--articles',
+            type=int,
+            default=None,
+            help='how many popular articles to render, default is the sidebar article count')
+        parser.add_argument(
+            '--max-priority',
+            type=int,
+            default=2,
+            help='0: index pages and popular articles, 1: archives and categories, 2: tags, authors and pages')
+
+    def handle(self, *args, **options):
+        urls = [(priority, url) for priority, url in get_warmup_urls(
+            options['index_pages'], options['articles']) if priority <= options['max_priority']]
+        self.stdout.write('start warm %d urls' % len(urls))
+        results = warm_cache(urls, options['concurrency'])
+        for url, status, cost, size in results:
+            self.stdout.write('%d %8.1fms %10d bytes %s' %
+                              (status, cost * 1000, size, url))
+        self.stdout.write(self.style.SUCCESS(
+            'finish warm %d urls, %.1fms, %d bytes' % (
+                len(results),
+                sum(result[2] for result in results) * 1000,
+                sum(result[3] for result in results))))
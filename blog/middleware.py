@@ -13,16 +13,84 @@
 @time: 2017/1/19 上午12:36
 """
 
+import gzip
 import time
 import logging
+import zlib
 from ipware import get_client_ip
 from user_agents import parse
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from django.utils.text import compress_string
+from blog.cache_warmup import is_warmup_request
 from blog.documents import ELASTICSEARCH_ENABLED, ElaspedTimeDocumentManager
+from blog.page_cache import render_user_fragments
+from blog.view_counter import get_visitor_key, record_view
+from DjangoBlog.utils import cache, get_cache_tags_version, get_sha256, patch_cache_control_policy
+from DjangoBlog.utils import begin_request_memo, end_request_memo
 
 logger = logging.getLogger(__name__)
 
+# 页面中的渲染时间占位符,见OnlineMiddleware
+LOAD_TIMES_PLACEHOLDER = b'<!!LOAD_TIMES!!>'
+
+
+class RequestMemoMiddleware(object):
+    '''
+    为每个请求创建memo,见DjangoBlog.utils.request_memoize
+    '''
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        begin_request_memo()
+        try:
+            return self.get_response(request)
+        finally:
+            end_request_memo()
+
+
+class ArticleViewMiddleware(object):
+    '''
+    记录文章浏览量,放在PageCacheMiddleware之前,全页缓存命中的请求也会计数.
+    爬虫和缓存预热的请求不计数.见blog.view_counter
+    '''
+    url_name = 'blog:detailbyid'
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method == 'GET' and response.status_code in (200, 304):
+            match = request.resolver_match
+            if match is None:
+                try:
+                    match = resolve(request.path_info)
+                except Resolver404:
+                    match = None
+            if match is not None and match.view_name == self.url_name and \
+                    not is_warmup_request(request) and \
+                    not parse(request.META.get('HTTP_USER_AGENT', '')).is_bot:
+                try:
+                    record_view(int(match.kwargs['article_id']),
+                                get_visitor_key(request))
+                except Exception as e:
+                    logger.error(e)
+        return response
+
 
 class OnlineMiddleware(object):
+    '''
+    记录请求耗时并替换页面中的占位符.放在PageCacheMiddleware之前,全页缓存命中的请求也替换为本次的耗时
+    '''
+
     def __init__(self, get_response=None):
         self.get_response = get_response
         super().__init__()
@@ -47,9 +115,133 @@ class OnlineMiddleware(object):
                         log_datetime=timezone.now(),
                         useragent=user_agent,
                         ip=ip)
-                response.content = response.content.replace(
-                    b'<!!LOAD_TIMES!!>', str.encode(str(cast_time)[:5]))
+                if not response.has_header('Content-Encoding'):
+                    response.content = response.content.replace(
+                        LOAD_TIMES_PLACEHOLDER, str.encode(str(cast_time)[:5]))
             except Exception as e:
                 logger.error("Error OnlineMiddleware: %s" % e)
 
         return response
+
+
+class PageCacheMiddleware(object):
+    '''
+    GET请求的全页缓存,视图通过page_cache_timeout开启.
+    模板中与用户相关的部分是占位符,缓存的页面对所有用户相同.
+    同时保存替换为匿名用户片段并gzip压缩后的页面,匿名用户命中时直接返回,不需要渲染和再次压缩;
+    登录用户命中时替换占位符后返回.页面中有渲染时间占位符时不直接返回压缩的页面,由OnlineMiddleware替换.
+    同一页面同时未命中时只有一个请求渲染,其余请求等待结果.
+    '''
+    key_prefix = 'page_cache:'
+    lock_timeout = 10
+    # 不保存的响应头,命中时按请求重新生成
+    skip_headers = ('content-length', 'etag', 'cache-control', 'expires', 'vary')
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        view_class = self.get_view_class(request)
+        timeout = getattr(view_class, 'page_cache_timeout', None)
+        if request.method != 'GET' or not timeout:
+            return self.process_user_fragments(request, self.get_response(request))
+        key = self.get_cache_key(request, view_class)
+        entry = cache.get(key)
+        if entry is None:
+            lock_key = key + ':lock'
+            if cache.add(lock_key, 1, self.lock_timeout):
+                try:
+                    response = self.get_response(request)
+                    entry = self.store(request, response, key, timeout)
+                finally:
+                    cache.delete(lock_key)
+                if entry is None:
+                    return self.process_user_fragments(request, response)
+            else:
+                entry = self.wait_for_entry(key, lock_key)
+                if entry is None:
+                    return self.process_user_fragments(
+                        request, self.get_response(request))
+        return self.response_from_entry(request, entry, key, view_class)
+
+    @staticmethod
+    def get_view_class(request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return getattr(match.func, 'view_class', None)
+
+    def get_cache_key(self, request, view_class):
+        return '{prefix}{url}:{version}'.format(
+            prefix=self.key_prefix,
+            url=get_sha256(request.build_absolute_uri())[:32],
+            version=get_cache_tags_version(view_class.etag_depends_on))
+
+    @staticmethod
+    def process_user_fragments(request, response):
+        if not response.streaming and not response.has_header('Content-Encoding') and \
+                response.get('Content-Type', '').startswith('text/html'):
+            response.content = render_user_fragments(
+                response.content, request.user)
+        return response
+
+    def store(self, request, response, key, timeout):
+        """
+        缓存页面,返回缓存的内容,不能缓存时返回None
+        """
+        if response.status_code != 200 or response.streaming or response.cookies or \
+                response.has_header('Content-Encoding') or \
+                not response.get('Content-Type', '').startswith('text/html') or \
+                request.META.get('CSRF_COOKIE_USED'):
+            return None
+        shell = response.content
+        entry = {
+            'headers': [(k, v) for k, v in response.items() if k.lower() not in self.skip_headers],
+            'shell': zlib.compress(shell),
+            'anonymous': compress_string(render_user_fragments(shell, AnonymousUser())),
+            'load_times': LOAD_TIMES_PLACEHOLDER in shell,
+        }
+        cache.set(key, entry, timeout)
+        logger.info('set page cache.key:{key}'.format(key=key))
+        return entry
+
+    def wait_for_entry(self, key, lock_key):
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry
+            if not cache.has_key(lock_key):
+                # 渲染的请求结束了但是页面不能缓存
+                return None
+        return None
+
+    def response_from_entry(self, request, entry, key, view_class):
+        user = request.user
+        if user.is_authenticated:
+            response = HttpResponse(render_user_fragments(
+                zlib.decompress(entry['shell']), user))
+            etag = get_sha256('{key}:{user}'.format(key=key, user=user.pk))
+        else:
+            if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '') and \
+                    not entry.get('load_times'):
+                response = HttpResponse(entry['anonymous'])
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(gzip.decompress(entry['anonymous']))
+            patch_vary_headers(response, ('Accept-Encoding',))
+            etag = get_sha256(key)
+        for k, v in entry['headers']:
+            response[k] = v
+        response['ETag'] = 'W/"{etag}"'.format(etag=etag[:32])
+        response['Content-Length'] = str(len(response.content))
+        patch_cache_control_policy(
+            request, response, view_class.cache_control_policy)
+        return get_conditional_response(
+            request,
+            etag=response['ETag'],
+            last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+            response=response)
@@ -1,14 +1,17 @@
 import logging
 from abc import ABCMeta, abstractmethod, abstractproperty
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.conf import settings
 from uuslug import slugify
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from DjangoBlog.utils import get_current_site
-from DjangoBlog.utils import cache_decorator, cache
+from DjangoBlog.utils import get_blog_setting, get_current_site
+from DjangoBlog.utils import MARKDOWN_RENDERER_VERSION, render_markdown_content
+from DjangoBlog.utils import cache
 from django.utils.timezone import now
 from mdeditor.fields import MDTextField
 from accounts.models import BlogUser
@@ -31,6 +34,8 @@ class BaseModel(models.Model):
     last_mod_time = models.DateTimeField('修改時間', default=now)
 
     def save(self, *args, **kwargs):
+        if not kwargs.get('update_fields'):
+            self.last_mod_time = now()
         if 'slug' in self.__dict__:
             slug = getattr(
                 self, 'title') if 'title' in self.__dict__ else getattr(
@@ -52,7 +57,44 @@ class BaseModel(models.Model):
         pass
 
 
-class Article(BaseModel):
+class RenderedContentModel(models.Model):
+    """
+    保存时把markdown正文渲染为html,摘要和纯文本,页面直接输出,不在每次请求时渲染.
+    渲染器版本或摘要长度改变后执行./manage.py render_content重新渲染
+    """
+    RENDERED_FIELDS = ('body_html', 'excerpt_html', 'plain_text', 'render_version')
+
+    body_html = models.TextField('正文html', blank=True, default='', editable=False)
+    excerpt_html = models.TextField('摘要html', blank=True, default='', editable=False)
+    plain_text = models.TextField('純文字', blank=True, default='', editable=False)
+    render_version = models.CharField(
+        '渲染版本', max_length=32, blank=True, default='', editable=False)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def get_render_version():
+        # 渲染器版本和摘要长度,任一改变后已保存的html需要重新渲染
+        return '{version}.{length}'.format(
+            version=MARKDOWN_RENDERER_VERSION, length=get_blog_setting().article_sub_length)
+
+    def render_content(self):
+        self.body_html, self.excerpt_html, self.plain_text = render_markdown_content(
+            self.body, get_blog_setting().article_sub_length)
+        self.render_version = self.get_render_version()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if not update_fields or 'body' in update_fields:
+            self.render_content()
+            if update_fields:
+                kwargs['update_fields'] = set(
+                    update_fields) | set(self.RENDERED_FIELDS)
+        super().save(*args, **kwargs)
+
+
+class Article(RenderedContentModel, BaseModel):
     """文章"""
     STATUS_CHOICES = (
         ('d', '草稿'),
@@ -86,6 +128,9 @@ class Article(BaseModel):
         null=False)
     gallery = models.ForeignKey(Gallery, blank=True, null=True, verbose_name='相簿', on_delete=models.CASCADE)
     tags = models.ManyToManyField('Tag', verbose_name='標籤集合', blank=True)
+    # 由blog.view_counter批量更新,不发送post_save
+    views = models.PositiveIntegerField('瀏覽量', default=0, editable=False)
+
     def body_to_string(self):
         return self.body
 
@@ -93,10 +138,12 @@ class Article(BaseModel):
         return self.title
 
     class Meta:
-        ordering = ['-pub_time']
+        ordering = ['-pub_time', '-id']
         verbose_name = "文章"
         verbose_name_plural = verbose_name
         get_latest_by = 'id'
+        # 列表页按(pub_time, id)keyset分页,见blog.pagination
+        indexes = [models.Index(fields=['pub_time', 'id'])]
 
     def get_absolute_url(self):
         return reverse('blog:detailbyid', kwargs={
@@ -106,30 +153,41 @@ class Article(BaseModel):
             'day': self.created_time.day
         })
 
-    @cache_decorator(60 * 60 * 10)
     def get_category_tree(self):
-        tree = self.category.get_category_tree()
+        # 从分类目录树获取,不查询分类,见blog.category_tree
+        from blog.category_tree import get_category_tree
+        tree = get_category_tree().get_ancestors(self.category_id)
         names = list(map(lambda c: (c.name, c.get_absolute_url()), tree))
 
         return names
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 修改分类后需要更新原分类的文章数,见DjangoBlog.blog_signals
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
+    def public_photos(self):
+        # 相簿中公开的照片
+        return self.gallery.public() if self.gallery_id else []
+
     def get_admin_url(self):
         info = (self._meta.app_label, self._meta.model_name)
         return reverse('admin:%s_%s_change' % info, args=(self.pk,))
 
-    @cache_decorator(expiration=60 * 100)
     def next_article(self):
-        # 下一篇
-        return Article.objects.filter(
-            id__gt=self.id, status='p').order_by('id').first()
+        # 下一篇,id比当前文章大的第一篇已发表文章,见blog.archives.get_article_neighbors
+        from blog.archives import get_article_neighbors
+        return get_article_neighbors(self.id)[1]
 
-    @cache_decorator(expiration=60 * 100)
     def prev_article(self):
-        # 前一篇
-        return Article.objects.filter(id__lt=self.id, status='p').first()
+        # 前一篇,id比当前文章小的最后一篇已发表文章
+        from blog.archives import get_article_neighbors
+        return get_article_neighbors(self.id)[0]
 
 
 class Category(BaseModel):
@@ -143,6 +201,7 @@ class Category(BaseModel):
         on_delete=models.CASCADE)
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
     index = models.IntegerField(default=0, verbose_name="權重排序-越大越靠前")
+    article_count = models.PositiveIntegerField('文章數', default=0, editable=False)
 
     class Meta:
         ordering = ['-index']
@@ -157,44 +216,28 @@ class Category(BaseModel):
     def __str__(self):
         return self.name
 
-    @cache_decorator(60 * 60 * 10)
     def get_category_tree(self):
-        categorys = []
-
-        def parse(category):
-            categorys.append(category)
-            if category.parent_category:
-                parse(category.parent_category)
-
-        parse(self)
-        return categorys
+        """
+        获得当前分类到根分类的路径,见blog.category_tree
+        :return: [CategoryRecord],第一个为当前分类
+        """
+        from blog.category_tree import get_category_tree
+        return list(get_category_tree().get_ancestors(self.id))
 
-    @cache_decorator(60 * 60 * 10)
     def get_sub_categorys(self):
         """
         获得当前分类目录所有子集
-        :return:
+        :return: [CategoryRecord],第一个为当前分类
         """
-        categorys = []
-        all_categorys = Category.objects.all()
-
-        def parse(category):
-            if category not in categorys:
-                categorys.append(category)
-            childs = all_categorys.filter(parent_category=category)
-            for child in childs:
-                if category not in categorys:
-                    categorys.append(child)
-                parse(child)
-
-        parse(self)
-        return categorys
+        from blog.category_tree import get_category_tree
+        return list(get_category_tree().get_descendants(self.id))
 
 
 class Tag(BaseModel):
     """文章标签"""
     name = models.CharField('標籤', max_length=30, unique=True)
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
+    article_count = models.PositiveIntegerField('文章數', default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -202,9 +245,8 @@ class Tag(BaseModel):
     def get_absolute_url(self):
         return reverse('blog:tag_detail', kwargs={'tag_name': self.slug})
 
-    @cache_decorator(60 * 60 * 10)
     def get_article_count(self):
-        return Article.objects.filter(tags__name=self.name).distinct().count()
+        return self.article_count
 
     class Meta:
         ordering = ['name']
@@ -212,6 +254,31 @@ class Tag(BaseModel):
         verbose_name_plural = verbose_name
 
 
+def refresh_article_counts(tag_ids=(), category_ids=()):
+    """
+    重新计算标签和分类的已发表文章数,每个模型一条UPDATE语句
+    文章保存,删除和修改标签时由DjangoBlog.blog_signals调用,全部重新计算见./manage.py reconcile_article_counts
+    :param tag_ids: 需要更新的标签id
+    :param category_ids: 需要更新的分类id
+    :return:
+    """
+    tag_ids = set(tag_ids) - {None}
+    category_ids = set(category_ids) - {None}
+    with transaction.atomic():
+        if tag_ids:
+            counts = Article.tags.through.objects.filter(
+                tag=OuterRef('pk'), article__status='p').order_by().values(
+                'tag').annotate(count=Count('article')).values('count')
+            Tag.objects.filter(id__in=tag_ids).update(
+                article_count=Coalesce(Subquery(counts), 0))
+        if category_ids:
+            counts = Article.objects.filter(
+                category=OuterRef('pk'), status='p').order_by().values(
+                'category').annotate(count=Count('id')).values('count')
+            Category.objects.filter(id__in=category_ids).update(
+                article_count=Coalesce(Subquery(counts), 0))
+
+
 class Links(models.Model):
 
     name = models.CharField('名稱', max_length=30, unique=True)
@@ -301,11 +368,11 @@ class BlogSettings(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        from DjangoBlog.utils import cache
-        cache.clear()
+        from DjangoBlog.utils import invalidate_cache_tags
+        invalidate_cache_tags(self)
 
 
-class About(BaseModel):
+class About(RenderedContentModel, BaseModel):
     title = models.CharField('標題', max_length=200, unique=True, null=True)
     body = MDTextField('內容')
     pub_time = models.DateTimeField(
@@ -315,7 +382,7 @@ class About(BaseModel):
         verbose_name_plural = verbose_name
 
 
-class Page(BaseModel):
+class Page(RenderedContentModel, BaseModel):
     title = models.CharField('標題', max_length=200, unique=True, null=True)
     pub_time = models.DateTimeField('發表時間', blank=False, null=False, default=now)
     gallery = models.ForeignKey(Gallery, blank=True, null=True, verbose_name='相簿', on_delete=models.CASCADE)
@@ -339,6 +406,10 @@ class Page(BaseModel):
         return reverse(
             'blog:info_page', kwargs={'page_id': self.id})
 
+    def public_photos(self):
+        # 相簿中公开的照片
+        return self.gallery.public() if self.gallery_id else []
+
     def get_admin_url(self):
         info = (self._meta.app_label, self._meta.model_name)
         return reverse('admin:%s_%s_change' % info, args=(self.pk,))
\ No newline at end of file
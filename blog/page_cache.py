@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: page_cache.py
+@time: 2026/10/18
+
+全页缓存的用户片段.
+页面中与用户相关的部分(登录状态,编辑链接)在模板中输出为占位符,
+所以渲染出的页面对所有用户相同,可以整页缓存,返回前由PageCacheMiddleware替换为当前用户的内容.
+"""
+import re
+
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+USER_FRAGMENT_PREFIX = b'<!--user-fragment:'
+USER_FRAGMENT_RE = re.compile(rb'<!--user-fragment:(\w+):([\w,]*)-->')
+
+_user_fragments = {}
+
+
+def register_user_fragment(name):
+    """
+    注册用户片段,函数接收当前用户和占位符中的参数,返回html
+    :param name: 片段名称
+    """
+
+    def wrapper(func):
+        _user_fragments[name] = func
+        return func
+
+    return wrapper
+
+
+def user_fragment_placeholder(name, *args):
+    return '<!--user-fragment:{name}:{args}-->'.format(
+        name=name, args=','.join(str(arg) for arg in args))
+
+
+def render_user_fragments(content, user):
+    """
+    把页面中的占位符替换为当前用户的片段
+    :param content: 页面内容
+    :param user: 当前用户
+    :return: 替换后的页面内容
+    """
+    if USER_FRAGMENT_PREFIX not in content:
+        return content
+    rendered = {}
+
+    def replace(match):
+        placeholder = match.group(0)
+        if placeholder not in rendered:
+            func = _user_fragments.get(match.group(1).decode('utf-8'))
+            args = [arg for arg in match.group(2).decode(
+                'utf-8').split(',') if arg]
+            rendered[placeholder] = func(user, *args).encode(
+                'utf-8') if func else b''
+        return rendered[placeholder]
+
+    return USER_FRAGMENT_RE.sub(replace, content)
+
+
+@register_user_fragment('nav_login')
+def nav_login(user):
+    return render_to_string(
+        'share_layout/user_fragments/nav_login.html', {'user': user})
+
+
+@register_user_fragment('sidebar_login')
+def sidebar_login(user):
+    return render_to_string(
+        'share_layout/user_fragments/sidebar_login.html', {'user': user})
+
+
+@register_user_fragment('article_edit')
+def article_edit(user, article_id):
+    if not user.is_superuser:
+        return ''
+    return render_to_string('share_layout/user_fragments/article_edit.html', {
+        'admin_url': reverse('admin:blog_article_change', args=(article_id,))})
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: pagination.py
+@time: 2026/10/18
+
+按(pub_time, id)的keyset分页.
+每个列表缓存文章总数和每一页第一篇文章的(pub_time, id)作为锚点,只在列表依赖的模型写入后重新计算,
+第N页从锚点开始按索引查找,不需要每次请求COUNT(*)和OFFSET扫描,原有的page/<int:page>链接不变.
+"""
+import logging
+
+from django.db.models import Q
+
+from DjangoBlog.utils import get_cache_tags_version, get_or_compute
+
+logger = logging.getLogger(__name__)
+
+KEYSET_ORDERING = ('-pub_time', '-id')
+
+
+def get_page_anchors(listing, queryset, per_page, depends_on):
+    """
+    获得列表的文章总数和每一页的锚点
+    :param listing: 列表的缓存key,不包含页码
+    :param queryset: 列表的queryset
+    :param per_page: 每页数量
+    :param depends_on: 列表依赖的模型,写入后重新计算
+    :return: (总数, 锚点)
+    """
+    key = 'page_anchors:{listing}:{per_page}:{version}'.format(
+        listing=listing, per_page=per_page, version=get_cache_tags_version(depends_on))
+
+    def compute():
+        keys = list(queryset.order_by(
+            *KEYSET_ORDERING).values_list('pub_time', 'id'))
+        return (len(keys), tuple(keys[::per_page]))
+
+    # 旧的锚点会让页码错位,不返回旧值,等待重新计算的结果
+    return get_or_compute(key, compute, 60 * 60 * 10)
+
+
+def seek_page(queryset, anchor, per_page):
+    """
+    从锚点开始取一页
+    :param queryset: 列表的queryset
+    :param anchor: 该页第一篇文章的(pub_time, id)
+    :param per_page: 每页数量
+    :return:
+    """
+    pub_time, id = anchor
+    return queryset.filter(
+        Q(pub_time__lt=pub_time) | Q(pub_time=pub_time, id__lte=id)).order_by(
+        *KEYSET_ORDERING)[:per_page]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: popularity.py
+@time: 2026/10/18
+
+按时间衰减的热门文章.
+缓存中保存分数最高的POPULAR_ARTICLES_TOP_K篇文章的(id, 分数)列表和计算分数的时间,
+浏览量写入数据库时(见blog.view_counter.flush)把所有分数按半衰期POPULAR_ARTICLES_HALF_LIFE衰减到当前时间,
+加上新的浏览量后重新排序截断.所有分数衰减的比例相同,不在列表中的文章不需要保存分数.
+侧边栏读取一次缓存,按主键查询文章,不需要对整个表排序.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from DjangoBlog.utils import cache, get_blog_setting, invalidate_cache_tags
+
+logger = logging.getLogger(__name__)
+
+POPULAR_ARTICLES_KEY = 'popular_articles'
+# 侧边栏片段依赖的标签,显示的文章变化时失效,最多每POPULAR_ARTICLES_REFRESH_INTERVAL秒一次
+POPULAR_ARTICLES_TAG = 'blog.popular_articles'
+LOCK_TIMEOUT = 10
+
+
+def decay(entries, elapsed):
+    """
+    把分数衰减elapsed秒
+    :param entries: [(id, 分数)]
+    :param elapsed: 秒
+    :return:
+    """
+    factor = 0.5 ** (max(elapsed, 0) / settings.POPULAR_ARTICLES_HALF_LIFE)
+    return [(id, score * factor) for id, score in entries]
+
+
+def top_k(scores):
+    return tuple(sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[
+        :settings.POPULAR_ARTICLES_TOP_K])
+
+
+def displayed_ids(entries):
+    return tuple(id for id, _ in entries[:get_blog_setting().sidebar_article_count])
+
+
+def get_popular_entries():
+    """
+    获得热门文章列表,缓存中没有时按浏览量初始化
+    :return: (计算分数的时间, 上次使侧边栏失效的时间, 侧边栏显示的文章id, ((id, 分数), ...))
+    """
+    value = cache.get(POPULAR_ARTICLES_KEY)
+    if value is None:
+        from blog.models import Article
+        now = time.time()
+        entries = Article.objects.filter(status='p', views__gt=0).order_by(
+            '-views').values_list('id', 'views')[:settings.POPULAR_ARTICLES_TOP_K]
+        entries = top_k(dict(entries))
+        value = (now, now, displayed_ids(entries), entries)
+        cache.set(POPULAR_ARTICLES_KEY, value, None)
+        logger.info('set popular articles cache')
+    return value
+
+
+def add_views(counts):
+    """
+    加入新的浏览量
+    :param counts: {文章id: 浏览次数}
+    """
+    if not counts:
+        return
+    lock_key = POPULAR_ARTICLES_KEY + ':lock'
+    # 多个worker同时写入时后写入的覆盖先写入的,加锁减少丢失,拿不到锁时仍然写入
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    try:
+        updated_at, refreshed_at, displayed, entries = get_popular_entries()
+        now = time.time()
+        scores = dict(decay(entries, now - updated_at))
+        for id, count in counts.items():
+            scores[id] = scores.get(id, 0) + count
+        entries = top_k(scores)
+        if displayed_ids(entries) != displayed and \
+                now - refreshed_at > settings.POPULAR_ARTICLES_REFRESH_INTERVAL:
+            refreshed_at, displayed = now, displayed_ids(entries)
+            invalidate_cache_tags(POPULAR_ARTICLES_TAG)
+        cache.set(POPULAR_ARTICLES_KEY,
+                  (now, refreshed_at, displayed, entries), None)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def get_popular_articles(count):
+    """
+    热门文章
+    :param count: 数量
+    :return: [Article]
+    """
+    from blog.models import Article
+    ids = [id for id, _ in get_popular_entries()[3]]
+    if not ids:
+        return []
+    # 侧边栏用ArticleLinkRecord保存,需要发表时间
+    articles = Article.objects.filter(id__in=ids, status='p').only(
+        'id', 'title', 'pub_time', 'created_time').in_bulk()
+    return [articles[id] for id in ids if id in articles][:count]
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: records.py
+@time: 2026/10/18
+
+缓存列表数据时使用的只读对象.
+缓存中只保存模板需要的字段值组成的tuple,读取缓存时重建为只读对象,不需要查询数据库.
+"""
+import logging
+
+from django.conf import settings
+from django.db.models import Prefetch
+from photologue.models import Photo
+
+from blog.models import Article, Category, Links, Page, SideBar, Tag
+from DjangoBlog.utils import cache, get_cache_tag_versions
+
+logger = logging.getLogger(__name__)
+
+
+class Record(object):
+    """
+    只读对象,子类定义fields和model,fields同时作为__slots__
+    """
+    __slots__ = ()
+    fields = ()
+    model = None
+
+    def __init__(self, values):
+        for name, value in zip(self.fields, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "'{name}' object is read-only".format(name=type(self).__name__))
+
+    def __repr__(self):
+        return '<{name}: {pk}>'.format(name=type(self).__name__, pk=self.pk)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def _meta(self):
+        # 与模型实例一样可以作为缓存依赖标签,见DjangoBlog.utils.make_cache_tag
+        return self.model._meta
+
+    @classmethod
+    def dump(cls, obj):
+        return tuple(getattr(obj, name) for name in cls.fields)
+
+    @classmethod
+    def dump_many(cls, objs):
+        return tuple(cls.dump(obj) for obj in objs)
+
+    @classmethod
+    def load_many(cls, rows):
+        return RecordList(cls(row) for row in rows)
+
+
+class RecordList(list):
+    """
+    记录列表,filter只支持字段相等,模型实例或记录按主键比较,供模板中的query标签使用
+    """
+
+    def filter(self, **kwargs):
+        def match(record):
+            for name, value in kwargs.items():
+                if hasattr(value, 'pk'):
+                    name, value = name + '_id', value.pk
+                elif name not in record.fields:
+                    name += '_id'
+                if getattr(record, name) != value:
+                    return False
+            return True
+
+        return RecordList(record for record in self if match(record))
+
+
+class PagedRecords(object):
+    """
+    列表页缓存的一页记录,长度为总数,供Paginator分页
+    """
+
+    def __init__(self, records, count, offset):
+        self.records = records
+        self.count = count
+        self.offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start = (index.start or 0) - self.offset
+            stop = None if index.stop is None else index.stop - self.offset
+            return self.records[max(start, 0):stop]
+        return self.records[index - self.offset]
+
+
+class PhotoRecord(Record):
+    fields = ('id', 'title', 'url', 'thumbnail_url')
+    __slots__ = fields
+    model = Photo
+
+    @classmethod
+    def dump(cls, photo):
+        return (photo.id, photo.title, photo.get_absolute_url(),
+                photo.get_thumbnail_url())
+
+    def get_absolute_url(self):
+        return self.url
+
+    def get_thumbnail_url(self):
+        return self.thumbnail_url
+
+
+class TagRecord(Record):
+    fields = ('id', 'name', 'url')
+    __slots__ = fields
+    model = Tag
+
+    @classmethod
+    def dump(cls, tag):
+        return (tag.id, tag.name, tag.get_absolute_url())
+
+    def get_absolute_url(self):
+        return self.url
+
+    def __str__(self):
+        return self.name
+
+
+# 文章卡片依赖的其他模型,文章本身按实例依赖,编辑一篇文章只使这篇文章的卡片失效.
+# 作者修改后只使他的文章失效(见DjangoBlog.blog_signals.author_post_save_callback),登录等写入用户表不影响卡片
+ARTICLE_CARD_DEPENDS_ON = ('blog.category', 'blog.tag',
+                           'photologue.gallery', 'photologue.photo')
+
+
+class ArticleCard(Record):
+    """
+    列表页的文章卡片,不包含正文,只有保存时渲染的摘要.
+    列表页只缓存每一页的文章id,卡片按文章单独缓存,多个列表共用,缓存中没有的卡片一次查询
+    """
+    fields = ('id', 'title', 'type', 'excerpt_html', 'pub_time', 'url', 'public_photos',
+              'author_name', 'author_url', 'category_name', 'category_url', 'tags')
+    __slots__ = fields
+    model = Article
+
+    def __init__(self, values):
+        super().__init__(values)
+        object.__setattr__(self, 'public_photos',
+                           PhotoRecord.load_many(self.public_photos))
+        object.__setattr__(self, 'tags', TagRecord.load_many(self.tags))
+
+    @classmethod
+    def dump(cls, article):
+        return (article.id, article.title, article.type, article.excerpt_html,
+                article.pub_time, article.get_absolute_url(),
+                PhotoRecord.dump_many(cls.get_public_photos(article)),
+                article.author.username, article.author.get_absolute_url(),
+                article.category.name, article.category.get_absolute_url(),
+                TagRecord.dump_many(article.tags.all()))
+
+    @staticmethod
+    def get_public_photos(article):
+        """
+        文章相册的公开图片,load_many中已经预取时不再查询
+        :param article: 文章
+        :return:
+        """
+        if not article.gallery_id:
+            return ()
+        photos = getattr(article.gallery, 'public_photo_list', None)
+        return article.public_photos() if photos is None else photos
+
+    @classmethod
+    def dump_many(cls, queryset):
+        # 列表只缓存文章id
+        return tuple(queryset.values_list('id', flat=True))
+
+    @classmethod
+    def load_many(cls, ids):
+        article_tags = {id: 'blog.article:{id}'.format(id=id) for id in ids}
+        versions = get_cache_tag_versions(
+            list(article_tags.values()) + list(ARTICLE_CARD_DEPENDS_ON))
+        shared_version = '.'.join(versions[d] for d in ARTICLE_CARD_DEPENDS_ON)
+        keys = {id: 'article_card:{id}:{version}.{shared_version}'.format(
+            id=id, version=versions[article_tags[id]], shared_version=shared_version) for id in ids}
+        rows = cache.get_many(list(keys.values()))
+        missing = [id for id in ids if keys[id] not in rows]
+        if missing:
+            articles = Article.objects.filter(id__in=missing).defer(
+                'body', 'body_html', 'plain_text').select_related(
+                'author', 'category', 'gallery').prefetch_related(
+                'tags', Prefetch('gallery__photos', to_attr='public_photo_list',
+                                 queryset=Photo.objects.is_public().filter(sites__id=settings.SITE_ID)))
+            values = {keys[article.id]: cls.dump(article) for article in articles}
+            cache.set_many(values, 60 * 60 * 10)
+            rows.update(values)
+            logger.info('set article card cache.count:{count}'.format(count=len(values)))
+        return RecordList(cls(rows[keys[id]]) for id in ids if keys[id] in rows)
+
+    def get_absolute_url(self):
+        return self.url
+
+
+class ArticleLinkRecord(Record):
+    """
+    只显示标题和链接的文章,如归档页和导航
+    """
+    fields = ('id', 'title', 'pub_time', 'url')
+    __slots__ = fields
+    model = Article
+
+    @classmethod
+    def dump(cls, article):
+        return (article.id, article.title,
+                article.pub_time, article.get_absolute_url())
+
+    def get_absolute_url(self):
+        return self.url
+
+
+class CategoryRecord(Record):
+    fields = ('id', 'name', 'slug', 'url', 'parent_category_id')
+    __slots__ = fields
+    model = Category
+
+    @classmethod
+    def dump(cls, category):
+        return (category.id, category.name, category.slug,
+                category.get_absolute_url(), category.parent_category_id)
+
+    def get_absolute_url(self):
+        return self.url
+
+    def __str__(self):
+        return self.name
+
+
+class PageRecord(Record):
+    fields = ('id', 'title', 'url', 'parent_page_id')
+    __slots__ = fields
+    model = Page
+
+    @classmethod
+    def dump(cls, page):
+        return (page.id, page.title, page.get_absolute_url(),
+                page.parent_page_id)
+
+    def get_absolute_url(self):
+        return self.url
+
+    def __str__(self):
+        return self.title
+
+
+class LinkRecord(Record):
+    fields = ('id', 'name', 'link')
+    __slots__ = fields
+    model = Links
+
+    def __str__(self):
+        return self.name
+
+
+class SideBarRecord(Record):
+    fields = ('id', 'name', 'content')
+    __slots__ = fields
+    model = SideBar
+
+    def __str__(self):
+        return self.name
+
+
+class PageNode(PageRecord):
+    """
+    导航中的分页面,children为子页面
+    """
+    __slots__ = ('children',)
+
+    def __init__(self, values, children=()):
+        super().__init__(values)
+        object.__setattr__(self, 'children', children)
+
+    @classmethod
+    def dump_tree(cls, pages):
+        """
+        :param pages: 所有分页面
+        :return: ((字段值, 子页面), ...),从根页面开始
+        """
+        children = {}
+        for page in pages:
+            children.setdefault(page.parent_page_id, []).append(cls.dump(page))
+
+        def dump(parent_id, seen):
+            # 父页面出现循环时停止
+            return tuple((row, dump(row[0], seen | {row[0]}))
+                         for row in children.get(parent_id, ()) if row[0] not in seen)
+
+        return dump(None, frozenset())
+
+    @classmethod
+    def load_tree(cls, nodes):
+        return tuple(cls(row, cls.load_tree(children)) for row, children in nodes)
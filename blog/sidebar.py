@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: sidebar.py
+@time: 2026/10/18
+
+侧边栏数据快照.
+每种LinkShowType缓存一份侧边栏需要的数据,只保存记录的字段值,与用户无关,
+侧边栏依赖的模型写入后重新生成(见DjangoBlog.utils.CACHE_FRAGMENT_DEPENDS_ON['sidebar']),
+与用户相关的部分(登录,登出)是用户片段,见blog.page_cache.
+"""
+import logging
+import random
+
+from django.db.models import Q
+
+from blog.archives import get_archive_dates
+from blog.category_tree import get_category_tree
+from blog.models import Article, Links, LinkShowType, SideBar, Tag
+from blog.popularity import get_popular_articles
+from blog.records import ArticleLinkRecord, CategoryRecord, LinkRecord, SideBarRecord, TagRecord
+from DjangoBlog.utils import get_blog_setting, get_fragment_cache_version, get_or_compute
+
+logger = logging.getLogger(__name__)
+
+# 标签云字体大小的步长
+TAG_FONT_INCREMENT = 5
+
+
+def build_sidebar_snapshot(linktype):
+    """
+    查询数据库生成侧边栏快照
+    :param linktype: LinkShowType
+    :return: dict,值都是tuple
+    """
+    blogsetting = get_blog_setting()
+    count = blogsetting.sidebar_article_count
+    links = Links.objects.filter(is_enable=True).filter(
+        Q(show_type=str(linktype)) | Q(show_type=LinkShowType.A))
+
+    # 标签云 计算字体大小
+    # 根据总数计算出平均值 大小为 (数目/平均值)*步长
+    tags = list(Tag.objects.all())
+    sidebar_tags = [(t, t.article_count) for t in tags if t.article_count]
+    total = sum(c for t, c in sidebar_tags)
+    dd = 1 if (total == 0 or not len(tags)) else total / len(tags)
+    sidebar_tags = [(TagRecord.dump(t), c, (c / dd) * TAG_FONT_INCREMENT + 10)
+                    for t, c in sidebar_tags]
+    random.shuffle(sidebar_tags)
+
+    return {
+        'recent_articles': ArticleLinkRecord.dump_many(
+            Article.objects.filter(status='p').only('id', 'title', 'pub_time', 'created_time')[:count]),
+        'sidebar_categorys': CategoryRecord.dump_many(get_category_tree().categorys),
+        'most_read_articles': ArticleLinkRecord.dump_many(get_popular_articles(count)),
+        'article_dates': get_archive_dates(),
+        'sidabar_links': LinkRecord.dump_many(links),
+        'sidebar_tags': tuple(sidebar_tags),
+        'extra_sidebars': SideBarRecord.dump_many(
+            SideBar.objects.filter(is_enable=True).order_by('sequence')),
+    }
+
+
+def get_sidebar_snapshot(linktype):
+    """
+    获得侧边栏数据,所有用户共用
+    :param linktype: LinkShowType
+    :return: dict,模板上下文
+    """
+    key = 'sidebar_snapshot:{linktype}:{version}'.format(
+        linktype=linktype, version=get_fragment_cache_version('sidebar'))
+    # 侧边栏失效后只有一个worker重新生成,其余worker先使用上一份快照
+    value = get_or_compute(
+        key, lambda: build_sidebar_snapshot(linktype), 60 * 60 * 10,
+        stale_key='sidebar_snapshot:{linktype}:stale'.format(linktype=linktype))
+    return {
+        'recent_articles': ArticleLinkRecord.load_many(value['recent_articles']),
+        'sidebar_categorys': CategoryRecord.load_many(value['sidebar_categorys']),
+        'most_read_articles': ArticleLinkRecord.load_many(value['most_read_articles']),
+        'article_dates': value['article_dates'],
+        'sidabar_links': LinkRecord.load_many(value['sidabar_links']),
+        'sidebar_tags': [(TagRecord(t), c, size) for t, c, size in value['sidebar_tags']] or None,
+        'extra_sidebars': SideBarRecord.load_many(value['extra_sidebars']),
+    }
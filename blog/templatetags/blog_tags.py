@@ -14,22 +14,23 @@
 """
 
 from django import template
-from django.db.models import Q
 from django.conf import settings
 from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe
 import random
 from django.urls import reverse
-from blog.models import Article, Category, Tag, Links, SideBar, LinkShowType
+from blog.models import Article, Category, Tag
 from django.utils.encoding import force_text
 from django.shortcuts import get_object_or_404
 import hashlib
 import urllib
 from comments.models import Comment
-from DjangoBlog.utils import cache_decorator, cache
+from DjangoBlog.utils import cache_decorator, cache, request_memoize
 from django.contrib.auth import get_user_model
 from oauth.models import OAuthUser
 from DjangoBlog.utils import get_current_site
+from blog.page_cache import user_fragment_placeholder
+from blog.sidebar import get_sidebar_snapshot
 import logging
 
 logger = logging.getLogger(__name__)
@@ -57,8 +58,22 @@ def datetimeformat(data):
         return ""
 
 
+@register.simple_tag
+def fragment_cache_version(fragment_name, *objs):
+    """
+    获得模板片段缓存的依赖版本,作为{% cache %}的vary_on参数,依赖的模型写入后片段缓存失效
+    用法: {% fragment_cache_version 'sidebar' as sidebar_version %}
+    :param fragment_name: 片段名称
+    :param objs: 额外依赖的模型实例
+    :return:
+    """
+    from DjangoBlog.utils import get_fragment_cache_version
+    return get_fragment_cache_version(fragment_name, *objs)
+
+
 @register.filter(is_safe=True)
 @stringfilter
+@request_memoize
 def custom_markdown(content):
     from DjangoBlog.utils import CommonMarkdown
     return mark_safe(CommonMarkdown.get_markdown(content))
@@ -66,6 +81,7 @@ def custom_markdown(content):
 
 @register.filter(is_safe=True)
 @stringfilter
+@request_memoize
 def truncatechars_content(content):
     """
     获得文章内容的摘要
@@ -87,17 +103,18 @@ def truncate(content):
 
 
 @register.inclusion_tag('blog/tags/breadcrumb.html')
+@request_memoize
 def load_breadcrumb(article):
     """
     获得文章面包屑
     :param article:
     :return:
     """
-    names = article.get_category_tree()
     from DjangoBlog.utils import get_blog_setting
     blogsetting = get_blog_setting()
     site = get_current_site().domain
-    names.append((blogsetting.sitename, '/'))
+    # 缓存返回的对象可能被其他请求共享,不要原地修改
+    names = article.get_category_tree() + [(blogsetting.sitename, '/')]
     names = names[::-1]
 
     return {
@@ -108,6 +125,7 @@ def load_breadcrumb(article):
 
 
 @register.inclusion_tag('blog/tags/article_tag_list.html')
+@request_memoize
 def load_articletags(article):
     """
     文章标签
@@ -118,7 +136,7 @@ def load_articletags(article):
     tags_list = []
     for tag in tags:
         url = tag.get_absolute_url()
-        count = tag.get_article_count()
+        count = tag.article_count
         tags_list.append((
             url, count, tag, random.choice(settings.BOOTSTRAP_COLOR_TYPES)
         ))
@@ -128,48 +146,26 @@ def load_articletags(article):
 
 
 @register.inclusion_tag('blog/tags/sidebar.html')
+@request_memoize
 def load_sidebar(user, linktype):
     """
-    加载側邊欄
+    加载側邊欄,数据来自所有用户共用的快照,见blog.sidebar
     :return:
     """
-    logger.info('load sidebar')
-    from DjangoBlog.utils import get_blog_setting
-    blogsetting = get_blog_setting()
-    recent_articles = Article.objects.filter(
-        status='p')[:blogsetting.sidebar_article_count]
-    sidebar_categorys = Category.objects.all()
-    extra_sidebars = SideBar.objects.filter(
-        is_enable=True).order_by('sequence')
-    most_read_articles = Article.objects.filter(status='p')[:blogsetting.sidebar_article_count]
-    dates = Article.objects.datetimes('created_time', 'month', order='DESC')
-    links = Links.objects.filter(is_enable=True).filter(
-        Q(show_type=str(linktype)) | Q(show_type=LinkShowType.A))
-
-    # 标签云 计算字体大小
-    # 根据总数计算出平均值 大小为 (数目/平均值)*步长
-    increment = 5
-    tags = Tag.objects.all()
-    sidebar_tags = None
-    if tags and len(tags) > 0:
-        s = [t for t in [(t, t.get_article_count()) for t in tags] if t[1]]
-        count = sum([t[1] for t in s])
-        dd = 1 if (count == 0 or not len(tags)) else count / len(tags)
-        import random
-        sidebar_tags = list(
-            map(lambda x: (x[0], x[1], (x[1] / dd) * increment + 10), s))
-        random.shuffle(sidebar_tags)
+    context = get_sidebar_snapshot(linktype)
+    context['user'] = user
+    return context
 
-    return {
-        'recent_articles': recent_articles,
-        'sidebar_categorys': sidebar_categorys,
-        'most_read_articles': most_read_articles,
-        'article_dates': dates,
-        'user': user,
-        'sidabar_links': links,
-        'sidebar_tags': sidebar_tags,
-        'extra_sidebars': extra_sidebars
-    }
+
+@register.simple_tag
+def user_fragment(name, *args):
+    """
+    与用户相关的片段,输出占位符,由PageCacheMiddleware替换为当前用户的内容
+    :param name: 片段名称,见blog.page_cache
+    :param args: 片段参数
+    :return:
+    """
+    return mark_safe(user_fragment_placeholder(name, *args))
 
 
 @register.inclusion_tag('blog/tags/article_meta_info.html')
@@ -286,6 +282,7 @@ def load_article_detail(article, isindex, user, isblog=True):
 # return only the URL of the gravatar
 # TEMPLATE USE:  {{ email|gravatar_url:150 }}
 @register.filter
+@request_memoize
 def gravatar_url(email, size=40):
     """获得gravatar头像"""
     cachekey = 'gravatat/' + email
@@ -1,7 +1,8 @@
 from django.test import Client, RequestFactory, TestCase
-from blog.models import Article, Category, Tag, SideBar, Links
+from blog.models import Article, Category, Tag, SideBar, Links, Page
 from django.contrib.auth import get_user_model
-from DjangoBlog.utils import get_current_site, get_sha256
+from DjangoBlog.utils import get_blog_setting, get_current_site, get_sha256, get_cache_tags_version, cache
+from blog import view_counter
 from blog.forms import BlogSearchForm
 from django.core.paginator import Paginator
 from blog.templatetags.blog_tags import load_pagination_info, load_articletags
@@ -11,6 +12,7 @@ from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
 import os
+import time
 from django.core.management import call_command
 
 
@@ -168,6 +170,605 @@ class ArticleTest(TestCase):
         response = self.client.get(s['next_url'])
         self.assertEqual(response.status_code, 200)
 
+    def test_conditional_get(self):
+        from DjangoBlog.utils import get_blog_setting
+        get_blog_setting()
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category()
+        category.name = "category"
+        category.save()
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.type = 'a'
+        article.status = 'p'
+        article.save()
+        url = article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=%d' % settings.CACHE_CONTROL_MAX_AGE['article'],
+                      response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/feed/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/feed/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/sitemap.xml')
+        response = self.client.get(
+            '/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # 其他用户登录只保存last_login,不改变ETag
+        BlogUser.objects.create_user(username='otheruser', password='otheruser')
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(Client().login(username='otheruser', password='otheruser'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # 相册图片保存后ETag改变
+        from photologue.models import Photo
+        etag = self.client.get(url)['ETag']
+        Photo.objects.create(title='nicephoto', slug='nicephoto',
+                             image='photologue/photos/nicephoto.jpg')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response['ETag'])
+        etag = response['ETag']
+
+        article.title = "nicetitle2"
+        article.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_page_cache(self):
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        user.set_password("liangliangyy")
+        user.is_staff = True
+        user.is_superuser = True
+        user.save()
+        category = Category()
+        category.name = "category"
+        category.save()
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.type = 'a'
+        article.status = 'p'
+        article.save()
+        url = article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertContains(response, reverse('account:login'))
+        self.assertNotContains(response, '<!--user-fragment:')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        # 登录用户使用同一份缓存,替换用户片段
+        self.client.login(username='liangliangyy', password='liangliangyy')
+        response = self.client.get(url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertContains(response, reverse('account:logout'))
+        self.assertContains(response, article.get_admin_url())
+        self.assertNotContains(response, '<!--user-fragment:')
+        self.assertIn('private', response['Cache-Control'])
+
+        # 缓存的页面保留渲染时间占位符,命中时也替换为本次的耗时
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpResponse
+        from blog.middleware import OnlineMiddleware, PageCacheMiddleware
+        middleware = OnlineMiddleware(PageCacheMiddleware(
+            lambda request: HttpResponse(b'<p><!!LOAD_TIMES!!></p>')))
+        for i in range(2):
+            request = self.factory.get(url + '?loadtimes=1', HTTP_ACCEPT_ENCODING='gzip')
+            request.user = AnonymousUser()
+            response = middleware(request)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertNotIn(b'LOAD_TIMES', response.content)
+
+    def test_list_records(self):
+        from blog.views import IndexView
+        get_blog_setting()
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category()
+        category.name = "category"
+        category.save()
+        for i in range(3):
+            article = Article()
+            article.title = "nicetitle" + str(i)
+            article.body = "nicecontent"
+            article.author = user
+            article.category = category
+            article.type = 'a'
+            article.status = 'p'
+            article.save()
+        view = IndexView()
+        view.setup(self.factory.get('/'), page=2)
+        view.paginate_by = 2
+        view.get_queryset()
+        # 命中缓存时不查询数据库
+        with self.assertNumQueries(0):
+            article_list = view.get_queryset()
+            page = Paginator(article_list, 2).page(2)
+            self.assertEqual(len(article_list), 3)
+            self.assertEqual(len(page.object_list), 1)
+            record = page.object_list[0]
+        # 按(pub_time, id)倒序,第二页是最早的文章
+        self.assertEqual(record.title, 'nicetitle0')
+        self.assertEqual(record.get_absolute_url(),
+                         Article.objects.get(pk=record.pk).get_absolute_url())
+        with self.assertRaises(AttributeError):
+            record.title = 'title'
+        # 首页列表和分页锚点只依赖文章,新建分类和标签后只重新查询文章卡片
+        Category.objects.create(name='othercategory')
+        Tag.objects.create(name='othertag')
+        with self.assertNumQueries(2):
+            self.assertEqual(len(view.get_queryset()), 3)
+
+        # 文章卡片按文章缓存,编辑文章后只重新查询这篇文章,作者,分类一起查询,标签预取
+        from blog.records import ArticleCard
+        article.save()
+        ids = [record.pk, article.pk]
+        with self.assertNumQueries(2):
+            cards = ArticleCard.load_many(ids)
+        self.assertEqual([card.pk for card in cards], ids)
+        self.assertIn('nicecontent', cards[1].excerpt_html)
+        self.assertEqual(cards[1].category_name, 'category')
+        # 其他用户注册和登录不影响卡片,作者改名后只重新查询他的文章
+        other = BlogUser.objects.create_user(username='otheruser', password='otheruser')
+        self.assertTrue(self.client.login(username='otheruser', password='otheruser'))
+        with self.assertNumQueries(0):
+            ArticleCard.load_many(ids)
+        user.username = 'newname'
+        user.save()
+        with self.assertNumQueries(2):
+            cards = ArticleCard.load_many(ids)
+        self.assertEqual(cards[1].author_name, 'newname')
+
+        # 相册的公开图片一次预取,不按文章逐个查询,顺序与相册一致
+        from photologue.models import Gallery, Photo, PhotoSize, PhotoSizeCache
+        PhotoSize.objects.create(name='thumbnail', width=100, height=75)
+        self.addCleanup(PhotoSizeCache().reset)
+        gallery = Gallery.objects.create(title='cardgallery', slug='cardgallery')
+        photos = [Photo.objects.create(title='cardphoto%d' % i, slug='cardphoto%d' % i,
+                                       image='photologue/photos/cardphoto%d.jpg' % i,
+                                       is_public=i != 1) for i in range(3)]
+        gallery.photos.set([photos[2], photos[1], photos[0]])
+        for article in Article.objects.filter(pk__in=ids):
+            article.gallery = gallery
+            article.save()
+        PhotoSizeCache()
+        with self.assertNumQueries(3):
+            cards = ArticleCard.load_many(ids)
+        for card in cards:
+            self.assertEqual([photo.title for photo in card.public_photos],
+                             ['cardphoto2', 'cardphoto0'])
+
+    def test_detail_query_budget(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from comments.models import Comment
+        get_blog_setting()
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category()
+        category.name = "category"
+        category.save()
+        articles = []
+        for i in range(3):
+            article = Article()
+            article.title = "nicetitle" + str(i)
+            article.body = "nicecontent"
+            article.author = user
+            article.category = category
+            article.type = 'a'
+            article.status = 'p'
+            article.save()
+            articles.append(article)
+        for i in range(5):
+            tag = Tag()
+            tag.name = "nicetag" + str(i)
+            tag.save()
+            articles[1].tags.add(tag)
+        Comment.objects.bulk_create([Comment(
+            body='nicecomment', author=user, article=articles[1], is_enable=True) for i in range(5)])
+        # 侧边栏等全站共用的片段已经缓存
+        self.client.get(articles[0].get_absolute_url())
+        view_counter.flush()
+        # 文章和标签,上一篇和下一篇来自相邻文章索引,与标签和评论数量无关
+        for article in articles[1:]:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(article.get_absolute_url())
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(context.captured_queries), 2)
+
+    def test_view_counter(self):
+        # 其他测试缓冲的浏览量
+        view_counter.flush()
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.status = 'p'
+        article.save()
+
+        url = article.get_absolute_url()
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0 visitor1')
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0 visitor1')
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0 visitor2')
+        self.client.get(url, HTTP_USER_AGENT='Googlebot/2.1')
+        self.assertEqual(view_counter.get_pending_views(article.id), 2)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 0)
+
+        version = get_cache_tags_version(('blog.article',))
+        with self.assertNumQueries(1):
+            self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 2)
+        self.assertEqual(view_counter.get_pending_views(article.id), 0)
+        # 更新浏览量不使缓存失效
+        self.assertEqual(get_cache_tags_version(('blog.article',)), version)
+
+    def test_popular_articles(self):
+        from unittest import mock
+        from blog import popularity
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        articles = []
+        for i in range(3):
+            article = Article()
+            article.title = "nicetitle" + str(i)
+            article.body = "nicecontent"
+            article.author = user
+            article.category = category
+            article.status = 'p'
+            article.save()
+            articles.append(article)
+        cache.delete(popularity.POPULAR_ARTICLES_KEY)
+        self.assertEqual(popularity.get_popular_articles(10), [])
+
+        popularity.add_views({articles[0].id: 1, articles[1].id: 5})
+        self.assertEqual(popularity.get_popular_articles(10), articles[1::-1])
+        # 一个半衰期后articles[1]的分数为2.5
+        now = time.time() + settings.POPULAR_ARTICLES_HALF_LIFE
+        with mock.patch('blog.popularity.time.time', return_value=now):
+            popularity.add_views({articles[0].id: 1, articles[2].id: 3})
+        self.assertEqual(popularity.get_popular_articles(10),
+                         [articles[2], articles[1], articles[0]])
+        self.assertEqual(popularity.get_popular_articles(1), [articles[2]])
+        articles[2].status = 'd'
+        articles[2].save()
+        self.assertEqual(popularity.get_popular_articles(10), articles[1::-1])
+        # 生成侧边栏的链接不再逐篇查询
+        from blog.records import ArticleLinkRecord
+        with self.assertNumQueries(1):
+            ArticleLinkRecord.dump_many(popularity.get_popular_articles(10))
+
+    def test_sidebar_snapshot(self):
+        from blog.sidebar import get_sidebar_snapshot
+        from blog.templatetags.blog_tags import load_sidebar
+        get_blog_setting()
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.status = 'p'
+        article.save()
+        article.tags.add(Tag.objects.create(name="nicetag"))
+        Links.objects.create(name='nicelink', link='https://www.example.com', sequence=1)
+
+        snapshot = get_sidebar_snapshot('i')
+        self.assertEqual([a.title for a in snapshot['recent_articles']], ['nicetitle'])
+        self.assertEqual([l.name for l in snapshot['sidabar_links']], ['nicelink'])
+        self.assertEqual(snapshot['sidebar_tags'][0][1], 1)
+        # 所有用户共用,不查询数据库
+        with self.assertNumQueries(0):
+            self.assertEqual(load_sidebar(user, 'i')['recent_articles'][0].id, article.id)
+            self.assertEqual(load_sidebar(None, 'i')['recent_articles'][0].id, article.id)
+        Links.objects.create(name='nicelink2', link='https://www.example.com', sequence=2,
+                             show_type='s')
+        self.assertEqual([l.name for l in get_sidebar_snapshot('s')['sidabar_links']], ['nicelink2'])
+        self.assertEqual([l.name for l in get_sidebar_snapshot('i')['sidabar_links']], ['nicelink'])
+
+    def test_archive_index(self):
+        import datetime
+        from blog.archives import ARCHIVE_INDEX_KEY, get_archive_articles, get_archive_months
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        cache.delete(ARCHIVE_INDEX_KEY)
+        self.assertEqual(get_archive_months(), [])
+
+        articles = []
+        # 索引在事务提交之后更新
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(13):
+                article = Article()
+                article.title = "nicetitle" + str(i)
+                article.body = "nicecontent"
+                article.author = user
+                article.category = category
+                article.status = 'p'
+                article.pub_time = datetime.datetime(2020, 3, 1 + i)
+                article.save()
+                articles.append(article)
+            articles[0].pub_time = datetime.datetime(2019, 12, 1)
+            articles[0].save()
+        self.assertEqual(get_archive_months(), [(2020, [(3, 12)]), (2019, [(12, 1)])])
+        with self.assertNumQueries(0):
+            self.assertEqual([a.id for a in get_archive_articles(2020, 3)],
+                             [a.id for a in articles[:0:-1]])
+        with self.captureOnCommitCallbacks(execute=True):
+            articles[12].status = 'd'
+            articles[12].save()
+            articles[11].title = "nicetitle"
+            articles[11].save()
+            articles[0].delete()
+        self.assertEqual(get_archive_months(), [(2020, [(3, 11)])])
+        self.assertEqual(get_archive_articles(2020)[0].title, "nicetitle")
+        # 增量更新的结果与重新生成一致
+        index = cache.get(ARCHIVE_INDEX_KEY)
+        cache.delete(ARCHIVE_INDEX_KEY)
+        self.assertEqual(get_archive_months(), [(2020, [(3, 11)])])
+        self.assertEqual(cache.get(ARCHIVE_INDEX_KEY), index)
+        # 拿不到锁的worker标记索引,拿到锁的worker写回之后删除,下次使用时重新生成
+        from blog.archives import _update_archive_index
+        cache.add(ARCHIVE_INDEX_KEY + ':lock', 1, 10)
+        _update_archive_index([], False)
+        self.assertIsNone(cache.get(ARCHIVE_INDEX_KEY))
+        get_archive_months()
+        cache.delete(ARCHIVE_INDEX_KEY + ':lock')
+        _update_archive_index([], False)
+        self.assertIsNone(cache.get(ARCHIVE_INDEX_KEY))
+        get_archive_months()
+        _update_archive_index([], False)
+        self.assertEqual(cache.get(ARCHIVE_INDEX_KEY), index)
+
+        response = self.client.get(reverse('blog:archives'))
+        self.assertContains(response, reverse('blog:archives_month', kwargs={'year': 2020, 'month': 3}))
+        response = self.client.get(reverse('blog:archives_year', kwargs={'year': 2020}))
+        self.assertContains(response, articles[11].get_absolute_url())
+        self.assertContains(response, reverse('blog:archives_year_page', kwargs={'year': 2020, 'page': 2}))
+        response = self.client.get(reverse('blog:archives_month_page', kwargs={'year': 2020, 'month': 3, 'page': 2}))
+        self.assertContains(response, articles[1].get_absolute_url())
+        response = self.client.get(reverse('blog:archives_year', kwargs={'year': 2019}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_article_neighbors(self):
+        import datetime
+        from blog.archives import ARCHIVE_INDEX_KEY, NEIGHBOR_INDEX_KEY
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        cache.delete_many([ARCHIVE_INDEX_KEY, NEIGHBOR_INDEX_KEY])
+        articles = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(4):
+                article = Article()
+                article.title = "nicetitle" + str(i)
+                article.body = "nicecontent"
+                article.author = user
+                article.category = category
+                article.status = 'p'
+                # 发表时间与id的顺序相反
+                article.pub_time = datetime.datetime(2020, 3, 10 - i)
+                article.save()
+                articles.append(article)
+            articles[2].status = 'd'
+            articles[2].save()
+
+        def neighbors(article):
+            prev_article, next_article = article.prev_article(), article.next_article()
+            return (prev_article and prev_article.id, next_article and next_article.id)
+
+        neighbors(articles[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(neighbors(articles[0]), (None, articles[1].id))
+            self.assertEqual(neighbors(articles[1]), (articles[0].id, articles[3].id))
+            self.assertEqual(neighbors(articles[2]), (articles[1].id, articles[3].id))
+            self.assertEqual(neighbors(articles[3]), (articles[1].id, None))
+        response = self.client.get(articles[1].get_absolute_url())
+        self.assertContains(response, articles[0].get_absolute_url())
+        self.assertContains(response, articles[3].get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            articles[1].delete()
+        self.assertEqual(neighbors(articles[3]), (articles[0].id, None))
+
+    def test_category_tree(self):
+        from blog.category_tree import get_category_tree
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        root = Category.objects.create(name="root", slug="root")
+        child = Category.objects.create(name="child", slug="child", parent_category=root)
+        grandchild = Category.objects.create(
+            name="grandchild", slug="grandchild", parent_category=child)
+        other = Category.objects.create(name="other", slug="other")
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = grandchild
+        article.status = 'p'
+        article.save()
+
+        get_category_tree()
+        with self.assertNumQueries(0):
+            tree = get_category_tree()
+            self.assertEqual(set(tree.get_descendant_ids(root.id)),
+                             {root.id, child.id, grandchild.id})
+            self.assertEqual(tree.get_descendant_ids(other.id), (other.id,))
+            self.assertEqual([c.id for c in grandchild.get_category_tree()],
+                             [grandchild.id, child.id, root.id])
+            self.assertEqual(article.get_category_tree(), [
+                ('grandchild', grandchild.get_absolute_url()),
+                ('child', child.get_absolute_url()),
+                ('root', root.get_absolute_url())])
+        response = self.client.get(root.get_absolute_url())
+        self.assertEqual([a.id for a in response.context['article_list']], [article.id])
+        response = self.client.get(other.get_absolute_url())
+        self.assertEqual(len(response.context['article_list']), 0)
+        response = self.client.get(reverse('blog:category_detail', kwargs={'category_name': 'missing'}))
+        self.assertEqual(response.status_code, 404)
+
+        # 修改分类后重新读取
+        grandchild.parent_category = other
+        grandchild.save()
+        self.assertEqual(set(get_category_tree().get_descendant_ids(other.id)),
+                         {other.id, grandchild.id})
+        self.assertEqual([c.id for c in root.get_sub_categorys()], [root.id, child.id])
+
+    def test_navigation_snapshot(self):
+        from blog.context_processors import seo_processor
+        root = Page.objects.create(title="root")
+        child = Page.objects.create(title="child", parent_page=root)
+        grandchild = Page.objects.create(title="grandchild", parent_page=child)
+        other = Page.objects.create(title="other")
+        request = RequestFactory().get('/')
+
+        # 没有使用的值不读取缓存
+        with self.assertNumQueries(0):
+            context = seo_processor(request)
+        self.assertEqual(context['SITE_BASE_URL'], 'http://testserver/')
+        tree = context['nav_page_tree']
+        self.assertEqual([(n.id, [c.id for c in n.children]) for n in tree],
+                         [(root.id, [child.id]), (other.id, [])])
+        self.assertEqual([c.id for c in tree[0].children[0].children], [grandchild.id])
+        self.assertEqual(tree[0].children[0].children[0].get_absolute_url(),
+                         grandchild.get_absolute_url())
+        with self.assertNumQueries(0):
+            context = seo_processor(request)
+            self.assertEqual(len(context['nav_page_tree']), 2)
+            self.assertEqual(len(context['info_pages']), 4)
+
+        # 分页面修改后重新生成
+        grandchild.parent_page = None
+        grandchild.save()
+        tree = seo_processor(request)['nav_page_tree']
+        self.assertEqual([n.id for n in tree], [root.id, grandchild.id, other.id])
+        response = self.client.get('/')
+        self.assertContains(response, 'menu-item-{id}'.format(id=child.id))
+
+    def test_article_counts(self):
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="category")
+        category2 = Category.objects.create(name="category2")
+        tag = Tag.objects.create(name="nicetag")
+        tag2 = Tag.objects.create(name="nicetag2")
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.status = 'p'
+        article.save()
+        article.tags.add(tag, tag2)
+
+        def counts():
+            return [Tag.objects.get(pk=tag.pk).article_count,
+                    Tag.objects.get(pk=tag2.pk).article_count,
+                    Category.objects.get(pk=category.pk).article_count,
+                    Category.objects.get(pk=category2.pk).article_count]
+
+        self.assertEqual(counts(), [1, 1, 1, 0])
+        article = Article.objects.get(pk=article.pk)
+        article.category = category2
+        article.save()
+        self.assertEqual(counts(), [1, 1, 0, 1])
+        article.status = 'd'
+        article.save()
+        self.assertEqual(counts(), [0, 0, 0, 0])
+        article.status = 'p'
+        article.save()
+        article.tags.remove(tag2)
+        self.assertEqual(counts(), [1, 0, 0, 1])
+        article.tags.clear()
+        self.assertEqual(counts(), [0, 0, 0, 1])
+        tag.article_set.add(article)
+        self.assertEqual(counts(), [1, 0, 0, 1])
+
+        Tag.objects.update(article_count=5)
+        call_command("reconcile_article_counts")
+        self.assertEqual(counts(), [1, 0, 0, 1])
+
+        # 后台按状态过滤时批量设为草稿和发布,update之后queryset不再包含这些文章
+        from blog.admin import draft_article, makr_article_publish
+        from blog.archives import ARCHIVE_INDEX_KEY, get_archive_articles
+
+        def archived():
+            pub_time = article.pub_time
+            return article.id in [a.id for a in get_archive_articles(pub_time.year, pub_time.month)]
+
+        cache.delete(ARCHIVE_INDEX_KEY)
+        self.assertTrue(archived())
+        version = get_cache_tags_version((article,))
+        with self.captureOnCommitCallbacks(execute=True):
+            draft_article(None, None, Article.objects.filter(status='p', pk__in=[article.pk]))
+        self.assertEqual(counts(), [0, 0, 0, 0])
+        self.assertFalse(archived())
+        self.assertNotEqual(version, get_cache_tags_version((article,)))
+        with self.captureOnCommitCallbacks(execute=True):
+            makr_article_publish(None, None, Article.objects.filter(status='d', pk__in=[article.pk]))
+        self.assertEqual(counts(), [1, 0, 0, 1])
+        self.assertTrue(archived())
+        article.delete()
+        self.assertEqual(counts(), [0, 0, 0, 0])
+
+    def test_render_content(self):
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category()
+        category.name = "category"
+        category.save()
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "# nicetitle\n\n```python\nprint('hello')\n```"
+        article.author = user
+        article.category = category
+        article.save()
+        self.assertIn('<h1>nicetitle</h1>', article.body_html)
+        self.assertIn('highlight', article.body_html)
+        self.assertEqual(article.plain_text, "nicetitle\nprint('hello')")
+
+        Article.objects.filter(pk=article.pk).update(
+            body_html='', render_version='')
+        call_command("render_content")
+        article.refresh_from_db()
+        self.assertIn('<h1>nicetitle</h1>', article.body_html)
+        self.assertEqual(article.render_version,
+                         article.get_render_version())
+
     def test_image(self):
         import requests
         rsp = requests.get(
@@ -202,5 +803,40 @@ class ArticleTest(TestCase):
         call_command("ping_baidu", "all")
         call_command("create_testdata")
         call_command("clear_cache")
+        call_command("render_content", all=True)
         call_command("sync_user_avatar")
         call_command("build_search_words")
+
+    def test_warm_cache(self):
+        from io import StringIO
+        from blog.cache_warmup import get_warmup_urls
+        user = BlogUser.objects.get_or_create(
+            email="liangliangyy@gmail.com",
+            username="liangliangyy")[0]
+        category = Category.objects.create(name="warmcategory")
+        tag = Tag.objects.create(name="warmtag")
+        article = Article()
+        article.title = "nicetitle"
+        article.body = "nicecontent"
+        article.author = user
+        article.category = category
+        article.status = 'p'
+        article.save()
+        article.tags.add(tag)
+
+        urls = [url for priority, url in get_warmup_urls()]
+        for url in (reverse('blog:index'), article.get_absolute_url(), category.get_absolute_url(),
+                    tag.get_absolute_url(), reverse('blog:archives')):
+            self.assertIn(url, urls)
+        out = StringIO()
+        call_command("warm_cache", concurrency=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('finish warm %d urls' % len(urls), lines[-1])
+        self.assertEqual({line.split()[0] for line in lines[1:-1]}, {'200'})
+        # 预热请求不计入浏览量
+        self.assertEqual(view_counter.get_pending_views(article.id), 0)
+        # 预热之后首页和文章页直接从全页缓存返回,不查询数据库
+        view_counter.flush()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('blog:index')).status_code, 200)
+            self.assertEqual(self.client.get(category.get_absolute_url()).status_code, 200)
@@ -14,7 +14,6 @@
 """
 
 from django.urls import path
-from django.views.decorators.cache import cache_page
 from . import views
 from haystack.forms import ModelSearchForm
 from haystack.query import SearchQuerySet
@@ -65,10 +64,24 @@ urlpatterns = [
         name='tag_detail_page'),
     path(
         'archives.html',
-        cache_page(
-            60 * 60)(
-            views.ArchivesView.as_view()),
+        views.ArchivesView.as_view(),
         name='archives'),
+    path(
+        r'archives/<int:year>.html',
+        views.ArchivesView.as_view(),
+        name='archives_year'),
+    path(
+        r'archives/<int:year>/page/<int:page>.html',
+        views.ArchivesView.as_view(),
+        name='archives_year_page'),
+    path(
+        r'archives/<int:year>/<int:month>.html',
+        views.ArchivesView.as_view(),
+        name='archives_month'),
+    path(
+        r'archives/<int:year>/<int:month>/page/<int:page>.html',
+        views.ArchivesView.as_view(),
+        name='archives_month_page'),
     path(
         'links.html',
         views.LinkListView.as_view(),
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+@version: ??
+@license: MIT Licence
+@software: PyCharm
+@file: view_counter.py
+@time: 2026/10/18
+
+文章浏览量.
+每次浏览只在进程内累加,每隔VIEW_COUNT_FLUSH_INTERVAL秒用一条UPDATE ... CASE语句把所有文章的增量写入数据库,
+不调用save,不发送post_save,所以不会使缓存失效.
+同一访客在VIEW_COUNT_DEDUPE_WINDOW秒内重复浏览同一篇文章只计一次,记录保存在多个worker共享的缓存中.
+进程退出时写入剩余的增量,进程被强制结束时最多丢失一个间隔内的浏览量.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, F, When
+from ipware import get_client_ip
+
+from DjangoBlog.utils import get_sha256
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_CACHE = 'shared'
+# 缓冲的文章数超过时立即写入
+MAX_PENDING = 500
+
+_pending = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_last_flush = time.time()
+
+
+def get_visitor_key(request):
+    """
+    访客标识,登录用户为用户id,匿名用户为ip和User-Agent的hash
+    :param request:
+    :return:
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'u{pk}'.format(pk=user.pk)
+    ip, _ = get_client_ip(request)
+    return get_sha256('{ip}:{ua}'.format(
+        ip=ip, ua=request.META.get('HTTP_USER_AGENT', '')))[:32]
+
+
+def record_view(article_id, visitor):
+    """
+    记录一次浏览
+    :param article_id: 文章id
+    :param visitor: 访客标识,见get_visitor_key
+    :return: 是否计数,窗口内重复浏览返回False
+    """
+    key = 'article_viewed:{id}:{visitor}'.format(id=article_id, visitor=visitor)
+    try:
+        if not caches[DEDUPE_CACHE].add(key, 1, settings.VIEW_COUNT_DEDUPE_WINDOW):
+            return False
+    except Exception as e:
+        logger.error(e)
+    with _lock:
+        _pending[article_id] = _pending.get(article_id, 0) + 1
+        size = len(_pending)
+    if size >= MAX_PENDING or time.time() - _last_flush > settings.VIEW_COUNT_FLUSH_INTERVAL:
+        flush()
+    return True
+
+
+def get_pending_views(article_id):
+    """
+    本进程中还没有写入数据库的浏览量
+    """
+    with _lock:
+        return _pending.get(article_id, 0)
+
+
+def flush():
+    """
+    把本进程缓冲的浏览量写入数据库
+    :return: 更新的文章数
+    """
+    global _pending, _last_flush
+    if not _flush_lock.acquire(blocking=False):
+        return 0
+    try:
+        with _lock:
+            pending, _pending = _pending, {}
+            _last_flush = time.time()
+        if not pending:
+            return 0
+        from blog.models import Article
+        from blog.popularity import add_views
+        try:
+            # queryset.update不发送信号
+            updated = Article.objects.filter(id__in=list(pending)).update(
+                views=Case(*[When(id=id, then=F('views') + count) for id, count in pending.items()],
+                           default=F('views')))
+        except Exception as e:
+            logger.error(e)
+            # 写入失败时放回缓冲,下次重试
+            with _lock:
+                for id, count in pending.items():
+                    _pending[id] = _pending.get(id, 0) + count
+            return 0
+        try:
+            add_views(pending)
+        except Exception as e:
+            logger.error(e)
+        return updated
+    finally:
+        _flush_lock.release()
+
+
+# 测试结束时测试数据库已经删除,不在退出时写入
+if not settings.TESTING:
+    atexit.register(flush)
@@ -9,20 +9,63 @@ import datetime
 from django.views.generic.base import TemplateView, View
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
+from django.core.paginator import InvalidPage, Paginator
 from django.conf import settings
 from django import forms
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseForbidden
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseForbidden
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.contrib.auth.decorators import login_required
-from DjangoBlog.utils import cache, get_sha256, get_blog_setting
+from DjangoBlog.utils import cache, get_sha256, get_blog_setting, get_cache_tags_version
+from DjangoBlog.utils import CACHE_PAGE_DEPENDS_ON, get_page_etag, patch_cache_control_policy
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from blog.models import *
+from blog.archives import get_archive_articles, get_archive_months, get_article_neighbors
+from blog.category_tree import get_category_tree
+from blog.pagination import get_page_anchors, seek_page
+from blog.records import ArticleCard, PagedRecords
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class ArticleListView(ListView):
+class ConditionalGetMixin(object):
+    '''
+    渲染之前根据缓存版本计算ETag和Last-Modified,与请求匹配时直接返回304
+    '''
+    # 页面依赖的模型,任一模型写入后ETag改变
+    etag_depends_on = CACHE_PAGE_DEPENDS_ON
+    # settings.CACHE_CONTROL_MAX_AGE中的策略名称
+    cache_control_policy = 'default'
+    # 全页缓存时间,见blog.middleware.PageCacheMiddleware
+    page_cache_timeout = settings.PAGE_CACHE_TIMEOUT
+
+    def get_etag_depends_on(self):
+        return self.etag_depends_on
+
+    def get_last_modified(self):
+        '''
+        子类重写.页面主体内容的修改时间
+        '''
+        return None
+
+    def get_etag(self):
+        user = self.request.user
+        return get_page_etag(self.get_etag_depends_on(),
+                             self.get_last_modified(),
+                             user.pk if user.is_authenticated else '')
+
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(etag_func=lambda request, *args, **kwargs: self.get_etag(),
+                         last_modified_func=lambda request, *args, **kwargs: self.get_last_modified())(
+            super(ConditionalGetMixin, self).dispatch)
+        response = view(request, *args, **kwargs)
+        return patch_cache_control_policy(
+            request, response, self.cache_control_policy)
+
+
+class ArticleListView(ConditionalGetMixin, ListView):
     # template_name属性用于指定使用哪个模板进行渲染
     template_name = 'blog/article_index.html'
 
@@ -34,10 +77,21 @@ class ArticleListView(ListView):
     paginate_by = settings.PAGINATE_BY
     page_kwarg = 'page'
     link_type = LinkShowType.L
+    # 列表数据依赖的模型,写入后列表和分页锚点失效.文章卡片单独缓存,列表只随文章的增删和发布变化
+    cache_depends_on = ('blog.article',)
+    cache_control_policy = 'list'
+    # 缓存中保存的记录类型,见blog.records
+    record_class = ArticleCard
 
     def get_view_cache_key(self):
         return self.request.get['pages']
 
+    def get_cache_depends_on(self):
+        """
+        子类可重写.列表依赖的模型或模型实例,在get_listing_cache_key之后调用
+        """
+        return self.cache_depends_on
+
     @property
     def page_number(self):
         page_kwarg = self.page_kwarg
@@ -45,33 +99,71 @@ class ArticleListView(ListView):
             page_kwarg) or self.request.GET.get(page_kwarg) or 1
         return page
 
-    def get_queryset_cache_key(self):
+    def get_listing_cache_key(self):
         """
-        子类重写.获得queryset的缓存key
+        子类重写.获得列表的缓存key,不包含页码
         """
         raise NotImplementedError()
 
+    def get_queryset_cache_key(self):
+        """
+        获得queryset的缓存key
+        """
+        self.listing_cache_key = self.get_listing_cache_key()
+        return '{listing}:{page}'.format(
+            listing=self.listing_cache_key, page=self.page_number)
+
     def get_queryset_data(self):
         """
         子类重写.获取queryset的数据
         """
         raise NotImplementedError()
 
+    def dump_queryset(self, queryset):
+        """
+        把当前页的数据转换为可缓存的数据(文章id或记录),按blog.pagination中缓存的锚点keyset分页
+        :return: (数据, 总数, 当前页的偏移),不分页时总数为None
+        """
+        if not self.paginate_by:
+            return self.record_class.dump_many(queryset), None, 0
+        count, anchors = get_page_anchors(
+            self.listing_cache_key, queryset, self.paginate_by, self.get_cache_depends_on())
+        paginator = Paginator(range(count), self.paginate_by)
+        page = self.page_number
+        try:
+            number = paginator.validate_number(
+                paginator.num_pages if page == 'last' else page)
+        except InvalidPage:
+            number = 1
+        if number > len(anchors):
+            return (), count, 0
+        rows = self.record_class.dump_many(
+            seek_page(queryset, anchors[number - 1], self.paginate_by))
+        return rows, count, (number - 1) * self.paginate_by
+
+    def load_queryset(self, value):
+        rows, count, offset = value
+        records = self.record_class.load_many(rows)
+        if count is None:
+            return records
+        return PagedRecords(records, count, offset)
+
     def get_queryset_from_cache(self, cache_key):
         '''
-        缓存页面数据
+        缓存页面数据,只缓存当前页的文章id,文章卡片见blog.records.ArticleCard
         :param cache_key: 缓存key
         :return:
         '''
+        cache_key = '{key}:{version}'.format(
+            key=cache_key, version=get_cache_tags_version(self.get_cache_depends_on()))
         value = cache.get(cache_key)
-        if value:
+        if value is not None:
             logger.info('get view cache.key:{key}'.format(key=cache_key))
-            return value
         else:
-            article_list = self.get_queryset_data()
-            cache.set(cache_key, article_list)
+            value = self.dump_queryset(self.get_queryset_data())
+            cache.set(cache_key, value)
             logger.info('set view cache.key:{key}'.format(key=cache_key))
-            return article_list
+        return self.load_queryset(value)
 
     def get_queryset(self):
         '''
@@ -98,12 +190,11 @@ class IndexView(ArticleListView):
         article_list = Article.objects.filter(type='a', status='p')
         return article_list
 
-    def get_queryset_cache_key(self):
-        cache_key = 'index_{page}'.format(page=self.page_number)
-        return cache_key
+    def get_listing_cache_key(self):
+        return 'index'
 
 
-class ArticleDetailView(DetailView):
+class ArticleDetailView(ConditionalGetMixin, DetailView):
 
     '''
     文章详情页面
@@ -112,17 +203,27 @@ class ArticleDetailView(DetailView):
     model = Article
     pk_url_kwarg = 'article_id'
     context_object_name = "article"
+    cache_control_policy = 'article'
+
+    def get_queryset(self):
+        # 作者和分类一起查询,标签预取,模板中不再逐个查询
+        return Article.objects.select_related(
+            'author', 'category').prefetch_related('tags')
+
+    def get_last_modified(self):
+        return self.get_object().last_mod_time
 
     def get_object(self, queryset=None):
-        obj = super(ArticleDetailView, self).get_object()
-        self.object = obj
-        return obj
+        # 计算Last-Modified时已经查询过文章,渲染时直接使用
+        if getattr(self, 'object', None) is None:
+            self.object = super(ArticleDetailView, self).get_object(queryset)
+        return self.object
 
     def get_context_data(self, **kwargs):
         articleid = int(self.kwargs[self.pk_url_kwarg])
         user = self.request.user
-        kwargs['next_article'] = self.object.next_article
-        kwargs['prev_article'] = self.object.prev_article
+        kwargs['prev_article'], kwargs['next_article'] = get_article_neighbors(
+            self.object.id)
 
         return super(ArticleDetailView, self).get_context_data(**kwargs)
 
@@ -136,9 +237,17 @@ class AboutView(TemplateView):
         return context
 
 
-class PageView(DetailView):
+class PageView(ConditionalGetMixin, DetailView):
     template_name = 'share_layout/about.html'
     model = Page
+    cache_control_policy = 'page'
+
+    def get_last_modified(self):
+        if not hasattr(self, '_last_modified'):
+            self._last_modified = Page.objects.filter(
+                pk=self.kwargs['page_id']).values_list(
+                'last_mod_time', flat=True).first()
+        return self._last_modified
 
     def get_object(self, queryset=None):
         id = self.kwargs["page_id"]
@@ -157,26 +266,27 @@ class CategoryDetailView(ArticleListView):
     分类目录列表
     '''
     page_type = "分類目錄"
+    # 列表包含子分类的文章,分类目录树的任何修改都可能改变列表
+    cache_depends_on = ('blog.article', 'blog.category')
 
-    def get_queryset_data(self):
-        slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
+    def get_category(self):
+        # 从分类目录树获取,不查询数据库,见blog.category_tree
+        category = get_category_tree().get_by_slug(self.kwargs['category_name'])
+        if category is None:
+            raise Http404
+        self.categoryname = category.name
+        return category
 
-        categoryname = category.name
-        self.categoryname = categoryname
-        categorynames = list(
-            map(lambda c: c.name, category.get_sub_categorys()))
+    def get_queryset_data(self):
+        category = self.get_category()
         article_list = Article.objects.filter(
-            category__name__in=categorynames, status='p')
+            category_id__in=get_category_tree().get_descendant_ids(category.id), status='p')
         return article_list
 
-    def get_queryset_cache_key(self):
-        slug = self.kwargs['category_name']
-        category = get_object_or_404(Category, slug=slug)
-        categoryname = category.name
-        self.categoryname = categoryname
-        cache_key = 'category_list_{categoryname}_{page}'.format(
-            categoryname=categoryname, page=self.page_number)
+    def get_listing_cache_key(self):
+        category = self.get_category()
+        cache_key = 'category_list:{categoryname}'.format(
+            categoryname=category.name)
         return cache_key
 
     def get_context_data(self, **kwargs):
@@ -197,11 +307,10 @@ class AuthorDetailView(ArticleListView):
     '''
     page_type = '作者文章归档'
 
-    def get_queryset_cache_key(self):
+    def get_listing_cache_key(self):
         from uuslug import slugify
         author_name = slugify(self.kwargs['author_name'])
-        cache_key = 'author_{author_name}_{page}'.format(
-            author_name=author_name, page=self.page_number)
+        cache_key = 'author:{author_name}'.format(author_name=author_name)
         return cache_key
 
     def get_queryset_data(self):
@@ -232,15 +341,19 @@ class TagDetailView(ArticleListView):
             tags__name=tag_name, type='a', status='p')
         return article_list
 
-    def get_queryset_cache_key(self):
+    def get_listing_cache_key(self):
         slug = self.kwargs['tag_name']
         tag = get_object_or_404(Tag, slug=slug)
         tag_name = tag.name
         self.name = tag_name
-        cache_key = 'tag_{tag_name}_{page}'.format(
-            tag_name=tag_name, page=self.page_number)
+        self.tag = tag
+        cache_key = 'tag:{tag_name}'.format(tag_name=tag_name)
         return cache_key
 
+    def get_cache_depends_on(self):
+        # 只依赖这个标签,其他标签修改不影响
+        return self.cache_depends_on + (self.tag,)
+
     def get_context_data(self, **kwargs):
         # tag_name = self.kwargs['tag_name']
         tag_name = self.name
@@ -249,21 +362,45 @@ class TagDetailView(ArticleListView):
         return super(TagDetailView, self).get_context_data(**kwargs)
 
 
-class ArchivesView(ArticleListView):
+class ArchivesView(ConditionalGetMixin, ListView):
     '''
-    文章归档页面
+    文章归档页面,显示有文章的年份和月份,按年或按月分页显示文章,数据来自归档索引,见blog.archives
     '''
     page_type = '文章归档'
-    paginate_by = None
-    page_kwarg = None
+    paginate_by = settings.PAGINATE_BY
     template_name = 'blog/article_archives.html'
+    context_object_name = 'article_list'
+    cache_control_policy = 'list'
 
-    def get_queryset_data(self):
-        return Article.objects.filter(status='p').all()
+    def get_queryset(self):
+        year = self.kwargs.get('year')
+        if year is None:
+            return []
+        return get_archive_articles(year, self.kwargs.get('month'))
+
+    def get_allow_empty(self):
+        # 没有文章的年份和月份返回404
+        return 'year' not in self.kwargs
+
+    def get_page_url(self, number):
+        kwargs = {'year': self.kwargs['year'], 'page': number}
+        if 'month' in self.kwargs:
+            kwargs['month'] = self.kwargs['month']
+            return reverse('blog:archives_month_page', kwargs=kwargs)
+        return reverse('blog:archives_year_page', kwargs=kwargs)
 
-    def get_queryset_cache_key(self):
-        cache_key = 'archives'
-        return cache_key
+    def get_context_data(self, **kwargs):
+        kwargs['archive_months'] = get_archive_months()
+        kwargs['archive_year'] = self.kwargs.get('year')
+        kwargs['archive_month'] = self.kwargs.get('month')
+        context = super(ArchivesView, self).get_context_data(**kwargs)
+        page_obj = context['page_obj']
+        if page_obj is not None:
+            if page_obj.has_next():
+                context['next_url'] = self.get_page_url(page_obj.next_page_number())
+            if page_obj.has_previous():
+                context['previous_url'] = self.get_page_url(page_obj.previous_page_number())
+        return context
 
 
 class LinkListView(ListView):
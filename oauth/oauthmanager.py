@@ -152,7 +152,7 @@ class GoogleOauthManager(BaseOauthManager):
             return None
 
 
-@cache_decorator(expiration=100 * 60)
+@cache_decorator(expiration=100 * 60, depends_on=('oauth.oauthconfig',))
 def get_oauth_apps():
     configs = OAuthConfig.objects.filter(is_enable=True).all()
     if not configs:
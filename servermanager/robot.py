@@ -55,7 +55,7 @@ def convert_to_articlereply(articles, message):
             imgurl = imgs[0]
         article = Article(
             title=post.title,
-            description=truncatechars_content(post.body),
+            description=truncatechars_content(post.plain_text),
             img=imgurl,
             url=post.get_full_url()
         )